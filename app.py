@@ -3,86 +3,88 @@
 from flask import Flask, render_template, request
 from flask import redirect, jsonify, url_for, flash
 from functools import wraps
-from sqlalchemy import create_engine, asc, desc
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import desc, event, func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload, scoped_session, sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
-from database_setup import Base, User, Category, Item
+from database_setup import Base, User, Category, Item, RoutingSession
+from database_setup import create_db_engine, create_db_engines
+from migrations import upgrade
+from page_cache import PageCache
+from lru_cache import LRUCache
+from search import search_item_ids, search_items
+from serializers import select_categories, select_items
+from serializers import serialize_category, serialize_item
+from assets import load_manifest, send_asset
+from compression import compress_response, etag_variants
+from metrics import Metrics, SQL_BUCKETS
+from event_bus import CLOSED, EventBus
+from sessions import ServerSessionInterface, MemorySessionStore
+from sessions import SQLiteSessionStore
+from write_queue import WriteQueue
+from rate_limit import Limiter, MemoryLimiterStore, SQLiteLimiterStore
+from rate_limit import ConcurrencyLimit
+from template_cache import bytecode_cache, precompile_templates, time_blocks
 from flask import session as login_session
-import random
-import string
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.client import FlowExchangeError
-import httplib2
-import json
-from flask import make_response
-import requests
-from flask_oauthlib.client import OAuth, OAuthException
-import html
+from flask import make_response, Response, stream_with_context
+from flask.json import dumps as json_dumps
+from jinja2 import Template
+from config import load_config
+from werkzeug.middleware.proxy_fix import ProxyFix
+import atexit
+import datetime
+import hashlib
+import math
+import threading
+import time
 
 app = Flask(__name__)
+load_config(app.config)
 
-oauth = OAuth(app)
-
-app.config['GOOGLE_ID'] = json.loads(
-    open('client_secrets.json', 'r').read())['web']['client_id']
-
-APPLICATION_NAME = "Restaurant Menu Application"
-
-app.config['GOOGLE_SECRET'] = json.loads(
-    open('client_secrets.json', 'r').read())['web']['client_secret']
-
-app.config['GITHUB_ID'] = json.loads(
-    open('gh_client_secrets.json', 'r').read())['client_id']
-app.config['GITHUB_SECRET'] = json.loads(
-    open('gh_client_secrets.json', 'r').read())['client_secret']
-
-app.config['FACEBOOK_ID'] = json.loads(
-    open('fb_client_secrets.json', 'r').read())['web']['app_id']
-app.config['FACEBOOK_SECRET'] = json.loads(
-    open('fb_client_secrets.json', 'r').read())['web']['app_secret']
-
-app.config['SECRET_KEY'] = "UaGGGuWqikQaMIZ1JCn6vJXHIK003YBKlqk8sdzn"
-
-app.debug = True
+# Off in production: templates are then precompiled at startup and no
+# longer checked for changes on every render
+app.debug = app.config['DEBUG']
 app.secret_key = app.config.get('SECRET_KEY')
-
-google = oauth.remote_app(
-    'google',
-    consumer_key=app.config.get('GOOGLE_ID'),
-    consumer_secret=app.config.get('GOOGLE_SECRET'),
-    request_token_params={
-        'scope': 'email'
-    },
-    base_url='https://www.googleapis.com/oauth2/v1/',
-    request_token_url=None,
-    access_token_method='POST',
-    access_token_url='https://accounts.google.com/o/oauth2/token',
-    authorize_url='https://accounts.google.com/o/oauth2/auth',
-)
-
-github = oauth.remote_app(
-    'github',
-    consumer_key=app.config.get('GITHUB_ID'),
-    consumer_secret=app.config.get('GITHUB_SECRET'),
-    request_token_params={'scope': 'user:email'},
-    base_url='https://api.github.com/',
-    request_token_url=None,
-    access_token_method='POST',
-    access_token_url='https://github.com/login/oauth/access_token',
-    authorize_url='https://github.com/login/oauth/authorize'
-)
-
-facebook = oauth.remote_app(
-    'facebook',
-    consumer_key=app.config.get('FACEBOOK_ID'),
-    consumer_secret=app.config.get('FACEBOOK_SECRET'),
-    request_token_params={'scope': 'email'},
-    base_url='https://graph.facebook.com',
-    request_token_url=None,
-    access_token_url='/oauth/access_token',
-    access_token_method='GET',
-    authorize_url='https://www.facebook.com/dialog/oauth'
-)
+# Behind proxies (e.g. Heroku's router) the client address and scheme
+# come from the X-Forwarded-For/-Proto headers the trusted proxies set
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app,
+                            x_for=app.config['TRUSTED_PROXIES'],
+                            x_proto=app.config['TRUSTED_PROXIES'])
+
+# OAuth clients are only created (and flask_oauthlib only imported) the
+# first time someone logs in with the provider, see getOAuthApp().
+OAUTH_PROVIDERS = {
+    'google': dict(
+        request_token_params={
+            'scope': 'email'
+        },
+        base_url='https://www.googleapis.com/oauth2/v1/',
+        request_token_url=None,
+        access_token_method='POST',
+        access_token_url='https://accounts.google.com/o/oauth2/token',
+        authorize_url='https://accounts.google.com/o/oauth2/auth',
+    ),
+    'github': dict(
+        request_token_params={'scope': 'user:email'},
+        base_url='https://api.github.com/',
+        request_token_url=None,
+        access_token_method='POST',
+        access_token_url='https://github.com/login/oauth/access_token',
+        authorize_url='https://github.com/login/oauth/authorize'
+    ),
+    'facebook': dict(
+        request_token_params={'scope': 'email'},
+        base_url='https://graph.facebook.com',
+        request_token_url=None,
+        access_token_url='/oauth/access_token',
+        access_token_method='GET',
+        authorize_url='https://www.facebook.com/dialog/oauth'
+    ),
+}
+oauth_apps = {}
+oauth_transport = None
+oauth_lock = threading.Lock()
 
 
 # <UTIL>
@@ -96,30 +98,517 @@ def login_required(f):
             return redirect('/login')
     return decorated_function
 
-# OAUTH helper functions
 
+# Items are paged by id (keyset pagination), so every page costs the same
+# no matter how deep into a category it is.
+ITEMS_PER_PAGE = 50
+MAX_ITEMS_PER_PAGE = 500
 
-@google.tokengetter
-def get_google_oauth_token():
-    return login_session["token"]
 
+def getPageArgs():
+    limit = request.args.get("limit", ITEMS_PER_PAGE, type=int)
+    after = request.args.get("after", 0, type=int)
+    return max(1, min(limit, MAX_ITEMS_PER_PAGE)), max(0, after)
 
-@github.tokengetter
-def get_github_oauth_token():
-    return login_session["token"]
 
+def getItemPage(category_id, limit, after, rows=False):
+    """Return up to ``limit`` items with an id above ``after`` and the
+    cursor for the next page (None on the last page)
+
+    With ``rows`` the items are plain API rows instead of ORM objects.
+    """
+    if rows:
+        query = session.execute(select_items().where(
+            Item.category_id == category_id,
+            Item.id > after).order_by(Item.id).limit(limit + 1))
+    else:
+        query = session.query(Item).filter(
+            Item.category_id == category_id,
+            Item.id > after).order_by(Item.id).limit(limit + 1)
+    items = query.all()
+    if len(items) > limit:
+        return items[:limit], items[limit - 1].id
+    return items, None
+
+
+def getItemRows(ids):
+    """Serialize the items with the given ids, in that order, skipping the
+    ones that do not exist"""
+    if not ids:
+        return []
+    found = dict((row.id, row) for row in session.execute(
+        select_items().where(Item.id.in_(ids))))
+    return [serialize_item(found[i]) for i in ids if i in found]
+
+
+def touchCategory(category_id, db=None):
+    """Mark a category as changed after one of its items was written"""
+    if db is None:
+        db = session
+    db.query(Category).filter_by(id=category_id).update(
+        {Category.updated: datetime.datetime.utcnow()},
+        synchronize_session=False)
+
+
+# Conditional GET: the routes below look up only the version (updated
+# timestamps, counts) of what they would return, and answer with a 304
+# before loading or serializing anything if the client's copy is current.
+def isAnonymous():
+    """True if the page does not depend on the visitor's session"""
+    return ("username" not in login_session and
+            "_flashes" not in login_session)
+
+
+def getETag(*version):
+    """Strong ETag for the current URL, representation and ``version``"""
+    key = repr((request.full_path, wantsNDJSON()) + version)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def isNotModified(etag, last_modified):
+    if request.if_none_match:
+        # The client may hold any of the compressed variants
+        return any(request.if_none_match.contains(e)
+                   for e in etag_variants(etag))
+    if request.if_modified_since and last_modified:
+        last_modified = last_modified.replace(
+            microsecond=0, tzinfo=datetime.timezone.utc)
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def setValidators(response, etag, last_modified):
+    response = make_response(response)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.vary.add("Accept")
+    response.vary.add("Cookie")
+    return response
+
+
+def notModified(etag, last_modified):
+    # Confirm the variant the client has, compressed or not
+    for variant in etag_variants(etag):
+        if request.if_none_match.contains(variant):
+            etag = variant
+    return setValidators(Response(status=304), etag, last_modified)
+
+
+def cachedPage(etag, last_modified, tags, render):
+    """Answer an anonymous page request from the client's copy or the page
+    cache, calling render() only if neither is current
+
+    The ETag includes the version of the data, so pages written by another
+    worker never match a stale cache entry; invalidating ``tags`` from the
+    write routes just frees the memory early.
+    """
+    if isNotModified(etag, last_modified):
+        return notModified(etag, last_modified)
+    page = page_cache.get(etag)
+    if page is None:
+        page = render()
+        page_cache.set(etag, page, tags)
+    return setValidators(page, etag, last_modified)
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = 1000
+
+
+def wantsNDJSON():
+    best = request.accept_mimetypes.best_match(["application/json",
+                                                NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def wantsStream():
+    """True if the client asked for NDJSON or passed ?stream=1"""
+    return wantsNDJSON() or request.args.get("stream", 0, type=int)
+
+
+def streamRows(key, rows, meta=None):
+    """Stream the serialized ``rows`` as ``{"Meta": meta, key: [...]}`` (or
+    one object per line for NDJSON) without holding the whole result in
+    memory"""
+    ndjson = wantsNDJSON()
+
+    def generate():
+        if not ndjson:
+            yield "{"
+            if meta is not None:
+                yield '"Meta": %s, ' % json_dumps(meta)
+            yield '"%s": [' % key
+        chunk = []
+        first = True
+        for row in rows:
+            data = json_dumps(row)
+            if ndjson:
+                chunk.append(data + "\n")
+            elif first:
+                chunk.append(data)
+            else:
+                chunk.append(", " + data)
+            first = False
+            if len(chunk) >= STREAM_BATCH_SIZE:
+                yield "".join(chunk)
+                chunk = []
+        yield "".join(chunk)
+        if not ndjson:
+            yield "]}\n"
+
+    if ndjson:
+        mimetype = NDJSON_MIMETYPE
+    else:
+        mimetype = "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+# OAUTH helper functions
 
-@facebook.tokengetter
-def get_facebook_oauth_token():
+
+def get_oauth_token():
     return login_session["token"]
 
 
-# Connect to Database and create database session
-engine = create_engine('sqlite:///itemcatalog.db')
+def getOAuthApp(name):
+    """Return the OAuth client for a provider, registering it on first use"""
+    global oauth_transport
+    with oauth_lock:
+        if name not in oauth_apps:
+            from flask_oauthlib.client import OAuth
+            from oauth_http import PooledTransport
+            if oauth_transport is None:
+                oauth_transport = PooledTransport(
+                    app.config['OAUTH_CONNECT_TIMEOUT'],
+                    app.config['OAUTH_READ_TIMEOUT'],
+                    app.config['OAUTH_POOL_SIZE'])
+            oauth = app.extensions.get('oauthlib.client') or OAuth(app)
+            remote = oauth.remote_app(
+                name,
+                consumer_key=app.config.get(name.upper() + '_ID'),
+                consumer_secret=app.config.get(name.upper() + '_SECRET'),
+                **OAUTH_PROVIDERS[name])
+            remote.tokengetter(get_oauth_token)
+            # Token exchange and profile requests share one pool of
+            # keep-alive connections and time out instead of hanging
+            remote.http_request = oauth_transport.http_request
+            oauth_apps[name] = remote
+        return oauth_apps[name]
+
+
+# Connect to Database and create a database session per request. Reads
+# go through read_engine, writes through engine, which SQLite gives a
+# single connection.
+sqlite_pragmas = {'journal_mode': app.config['SQLITE_JOURNAL_MODE'],
+                  'synchronous': app.config['SQLITE_SYNCHRONOUS'],
+                  'busy_timeout': app.config['SQLITE_BUSY_TIMEOUT'],
+                  'mmap_size': app.config['SQLITE_MMAP_SIZE'],
+                  'cache_size': app.config['SQLITE_CACHE_SIZE']}
+read_engine, engine = create_db_engines(
+    app.config['DATABASE_URL'],
+    pool_size=app.config['DB_POOL_SIZE'],
+    max_overflow=app.config['DB_MAX_OVERFLOW'],
+    pool_timeout=app.config['DB_POOL_TIMEOUT'],
+    pragmas=sqlite_pragmas)
 Base.metadata.bind = engine
+upgrade(engine)
+
+DBSession = sessionmaker(class_=RoutingSession, reader=read_engine,
+                         writer=engine)
+session = scoped_session(DBSession)
+
+# Form submits can be committed in batches by one writer thread
+write_queue = None
+if app.config['WRITE_QUEUE']:
+    write_queue = WriteQueue(sessionmaker(bind=engine),
+                             app.config['WRITE_BATCH_SIZE'],
+                             app.config['WRITE_BATCH_DELAY'])
+    atexit.register(write_queue.close)
+
+
+def runWrite(job):
+    """Run ``job(session)`` and commit it, batched with the writes of other
+    requests if the write queue is on; returns what the job returned"""
+    if write_queue is None:
+        result = job(session)
+        session.commit()
+        return result
+    return write_queue.run(job)
+
+
+# Keep login sessions on the server, the cookie only holds their id
+# ("cookie" keeps Flask's signed cookie sessions)
+if app.config['SESSION_BACKEND'] == 'sqlite':
+    app.session_interface = ServerSessionInterface(
+        SQLiteSessionStore(create_db_engine(
+            app.config['SESSION_DATABASE_URL'], pragmas=sqlite_pragmas)),
+        app.config['SESSION_TTL'])
+elif app.config['SESSION_BACKEND'] == 'memory':
+    app.session_interface = ServerSessionInterface(
+        MemorySessionStore(app.config['SESSION_CACHE_SIZE']),
+        app.config['SESSION_TTL'])
+
+
+# Rendered anonymous pages, keyed by their ETag
+page_cache = PageCache(app.config['PAGE_CACHE_SIZE'])
+
+
+# Request, SQL, pool and template timings, served on /metrics
+metrics = Metrics(app.config['METRICS_DIR'],
+                  app.config['METRICS_FLUSH_INTERVAL'])
+metrics.counter("catalog_http_requests_total",
+                "Requests by endpoint, method and status",
+                ("endpoint", "method", "status"))
+metrics.histogram("catalog_http_request_duration_seconds",
+                  "Time to answer a request", ("endpoint",))
+metrics.histogram("catalog_sql_statement_duration_seconds",
+                  "SQL statements run for each endpoint", ("endpoint",),
+                  SQL_BUCKETS)
+metrics.histogram("catalog_db_pool_wait_seconds",
+                  "Time spent waiting for a pooled connection",
+                  ("engine",), SQL_BUCKETS)
+metrics.histogram("catalog_template_render_seconds",
+                  "Time to render a template", ("template",), SQL_BUCKETS)
+template_profile = app.config['TEMPLATE_PROFILE']
+if template_profile:
+    metrics.histogram("catalog_template_block_render_seconds",
+                      "Time to render a template block",
+                      ("template", "block"), SQL_BUCKETS)
+    metrics.histogram("catalog_template_sql_seconds",
+                      "SQL run while rendering a template (lazy loads)",
+                      ("template",), SQL_BUCKETS)
+# The endpoint the current thread is serving, for the SQL events
+current_request = threading.local()
+
+
+def currentEndpoint():
+    return getattr(current_request, "endpoint", None) or "none"
+
+
+@app.before_request
+def startRequestTimer():
+    current_request.endpoint = request.endpoint
+    current_request.start = time.perf_counter()
+
+
+# Registered before compress(), so that it runs after it
+@app.after_request
+def recordRequest(response):
+    endpoint = currentEndpoint()
+    metrics.inc("catalog_http_requests_total",
+                (endpoint, request.method, str(response.status_code)))
+    metrics.observe("catalog_http_request_duration_seconds", (endpoint,),
+                    time.perf_counter() - current_request.start)
+    metrics.flush()
+    return response
+
+
+@app.teardown_request
+def stopRequestTimer(exception=None):
+    # Streamed responses run their queries until here
+    current_request.endpoint = None
+
+
+def startQueryTimer(conn, cursor, statement, parameters, context,
+                    executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def stopQueryTimer(conn, cursor, statement, parameters, context,
+                   executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"]
+    metrics.observe("catalog_sql_statement_duration_seconds",
+                    (currentEndpoint(),), elapsed)
+    if template_profile:
+        current_request.sql_seconds = getattr(
+            current_request, "sql_seconds", 0.0) + elapsed
+
+
+def timePoolWaits(db_engine, name):
+    """Time how long getting a connection from the engine's pool takes
+    (SQLAlchemy has no event for the start of a checkout)"""
+    pool = db_engine.pool
+    do_get = pool._do_get
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            metrics.observe("catalog_db_pool_wait_seconds", (name,),
+                            time.perf_counter() - start)
+    pool._do_get = timed_do_get
+
+
+if read_engine is engine:
+    db_engines = ((engine, "default"),)
+else:
+    db_engines = ((read_engine, "reader"), (engine, "writer"))
+for db_engine, name in db_engines:
+    event.listen(db_engine, "before_cursor_execute", startQueryTimer)
+    event.listen(db_engine, "after_cursor_execute", stopQueryTimer)
+    timePoolWaits(db_engine, name)
+
+
+def observeBlock(template, block, seconds):
+    metrics.observe("catalog_template_block_render_seconds",
+                    (template, block), seconds)
+
+
+class TimedTemplate(Template):
+    @classmethod
+    def from_code(cls, environment, code, globals, uptodate=None):
+        template = super(TimedTemplate, cls).from_code(
+            environment, code, globals, uptodate)
+        if template_profile:
+            time_blocks(template, observeBlock)
+        return template
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        sql_start = getattr(current_request, "sql_seconds", 0.0)
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            metrics.observe("catalog_template_render_seconds", (self.name,),
+                            time.perf_counter() - start)
+            if template_profile:
+                metrics.observe("catalog_template_sql_seconds", (self.name,),
+                                getattr(current_request, "sql_seconds", 0.0) -
+                                sql_start)
+
+
+app.jinja_env.template_class = TimedTemplate
+# Compiled templates are kept on disk, shared by workers and restarts
+if app.config['TEMPLATE_CACHE_DIR']:
+    app.jinja_env.bytecode_cache = bytecode_cache(
+        app.config['TEMPLATE_CACHE_DIR'])
+if not app.debug:
+    precompile_templates(app.jinja_env)
+
+
+@app.route("/metrics")
+def metricsPage():
+    return Response(metrics.render(),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# Admission control: rate limits per client and budget, and caps on the
+# requests this process serves at once
+rate_limits = {
+    "api": (app.config['RATE_LIMIT_API_RATE'],
+            app.config['RATE_LIMIT_API_BURST']),
+    "html": (app.config['RATE_LIMIT_HTML_RATE'],
+             app.config['RATE_LIMIT_HTML_BURST']),
+    "write": (app.config['RATE_LIMIT_WRITE_RATE'],
+              app.config['RATE_LIMIT_WRITE_BURST']),
+}
+limiter = None
+if app.config['RATE_LIMIT_STORE'] == 'memory':
+    limiter = Limiter(MemoryLimiterStore(app.config['RATE_LIMIT_CLIENTS']),
+                      rate_limits)
+elif app.config['RATE_LIMIT_STORE'] == 'sqlite':
+    limiter = Limiter(SQLiteLimiterStore(create_db_engine(
+        app.config['RATE_LIMIT_DATABASE_URL'], pragmas=sqlite_pragmas)),
+        rate_limits)
+request_slots = ConcurrencyLimit(app.config['MAX_CONCURRENT_REQUESTS'])
+write_slots = ConcurrencyLimit(app.config['MAX_CONCURRENT_WRITES'])
+metrics.counter("catalog_rejected_requests_total",
+                "Requests turned away by rate limits and concurrency caps",
+                ("budget", "status"))
+# Never limited; feed streams stay open, so they don't take a slot either
+UNLIMITED_ENDPOINTS = ("static", "asset", "metricsPage")
+UNCAPPED_ENDPOINTS = ("feedStream",)
+
+
+def requestBudget():
+    if request.method not in ("GET", "HEAD") or \
+            request.endpoint in ("deleteItem", "deleteCategory"):
+        return "write"
+    if request.path.startswith("/api/"):
+        return "api"
+    return "html"
+
+
+def clientKey():
+    if "user_id" in login_session:
+        return "user:%s" % login_session["user_id"]
+    return "ip:%s" % request.remote_addr
+
+
+def rejectRequest(status, retry_after, budget):
+    metrics.inc("catalog_rejected_requests_total", (budget, str(status)))
+    if request.path.startswith("/api/"):
+        response = jsonify(Error="Too many requests, retry later")
+    else:
+        response = make_response(render_template(
+            "error.html", error=status, login_session=login_session))
+    response.status_code = status
+    response.headers["Retry-After"] = str(int(math.ceil(retry_after)))
+    return response
+
+
+@app.before_request
+def admitRequest():
+    current_request.slots = ()
+    if request.endpoint in UNLIMITED_ENDPOINTS:
+        return None
+    budget = requestBudget()
+    if limiter is not None:
+        wait = limiter.check(budget, clientKey())
+        if wait:
+            return rejectRequest(429, wait, budget)
+    if request.endpoint in UNCAPPED_ENDPOINTS:
+        return None
+    slots = [request_slots]
+    if budget == "write":
+        slots.append(write_slots)
+    taken = []
+    for slot in slots:
+        if not slot.acquire():
+            for held in taken:
+                held.release()
+            return rejectRequest(503, 1, budget)
+        taken.append(slot)
+    current_request.slots = taken
 
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+
+@app.teardown_request
+def releaseRequestSlots(exception=None):
+    for slot in getattr(current_request, "slots", ()):
+        slot.release()
+    current_request.slots = ()
+
+
+# Fingerprinted static files from ``python assets.py build``, if any
+asset_manifest = load_manifest()
+
+
+@app.template_global()
+def asset_url(path):
+    """URL of a file under static/, fingerprinted if it has been built"""
+    if path in asset_manifest:
+        return url_for("asset", filename=asset_manifest[path])
+    return url_for("static", filename=path)
+
+
+@app.route("/assets/<path:filename>")
+def asset(filename):
+    return send_asset(filename, request.accept_encodings)
+
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request.accept_encodings,
+                             app.config['COMPRESS_MIN_SIZE'],
+                             app.config['COMPRESS_LEVEL'])
+
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    # Rolls back anything left uncommitted (e.g. after a failed commit) and
+    # hands the connection back to the pool.
+    session.remove()
 
 
 @app.errorhandler(404)
@@ -159,7 +648,19 @@ def page_server_error(e):
 @app.route("/feed")
 @app.route("/feed/index")
 def index():
-    latest = session.query(Item).order_by(desc(Item.id)).limit(10)
+    if not isAnonymous():
+        return renderFeed()
+    # Every item write touches its category, so the categories alone
+    # tell whether anything on the feed changed. No Last-Modified: deleting
+    # a category leaves the newest date alone, only the ETag changes.
+    count, updated = session.query(func.count(Category.id),
+                                   func.max(Category.updated)).one()
+    return cachedPage(getETag(count, updated), None, ("feed",), renderFeed)
+
+
+def renderFeed():
+    latest = session.query(Item).options(
+        joinedload(Item.category)).order_by(desc(Item.id)).limit(10)
     categories = session.query(Category).order_by(Category.id)
     return render_template("feed.html",
                            latest=latest,
@@ -167,6 +668,89 @@ def index():
                            login_session=login_session)
 
 
+# Item changes for the /feed/stream clients of this process
+feed_events = EventBus(app.config['FEED_STREAM_QUEUE'])
+
+
+def publishItemEvent(action, item_id, data):
+    """Send a "created", "edited" or "deleted" event to /feed/stream
+
+    Only creations carry an SSE id, so the Last-Event-ID of a client is
+    always the newest item id it has seen.
+    """
+    if not feed_events:
+        return
+    message = "event: %s\n" % action
+    if action == "created":
+        message += "id: %d\n" % item_id
+    message += "data: %s\n\n" % json_dumps(data)
+    feed_events.publish((item_id if action == "created" else None, message))
+
+
+@app.route("/feed/stream")
+def feedStream():
+    """Server-Sent Events for items created, edited and deleted from now on
+
+    A client reconnecting with Last-Event-ID (or ?after=) first gets all
+    items created since then. The stream holds no database connection and
+    waits in EventBus, so run gunicorn with gevent workers to keep many
+    clients open (``gunicorn -k gevent app:app``).
+    """
+    after = request.headers.get("Last-Event-ID", type=int)
+    if after is None:
+        after = request.args.get("after", type=int)
+    # Subscribe before reading the backlog, so nothing falls in between
+    subscription = feed_events.subscribe()
+    heartbeat = app.config['FEED_STREAM_HEARTBEAT']
+
+    def generate():
+        last = after
+        try:
+            yield "retry: 5000\n\n"
+            if last is not None:
+                for row in readBacklog(last):
+                    last = row.id
+                    yield "event: created\nid: %d\ndata: %s\n\n" % (
+                        row.id, json_dumps(serialize_item(row)))
+            while True:
+                event = subscription.get(heartbeat)
+                if event is CLOSED:
+                    return
+                if event is None:
+                    # Also notices clients that have gone away
+                    yield ": keep-alive\n\n"
+                    continue
+                item_id, message = event
+                if item_id is not None and last is not None and \
+                        item_id <= last:
+                    continue
+                yield message
+        finally:
+            feed_events.unsubscribe(subscription)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache",
+                             "X-Accel-Buffering": "no"})
+
+
+def readBacklog(after):
+    """Yield the items created after ``after``, reading a page per query
+    so no connection is held while the client catches up"""
+    while True:
+        page_session = DBSession()
+        try:
+            rows = page_session.execute(select_items().where(
+                Item.id > after).order_by(Item.id).limit(
+                    MAX_ITEMS_PER_PAGE)).all()
+        finally:
+            page_session.close()
+        for row in rows:
+            yield row
+        if len(rows) < MAX_ITEMS_PER_PAGE:
+            return
+        after = rows[-1].id
+
+
 @app.route("/users/list")
 @app.route("/users/list/index")
 def userlist():
@@ -179,56 +763,328 @@ def userlist():
 @app.route("/api/categories.json")
 @app.route("/api/categories")
 def categoriesJson():
-    categories = session.query(Category)
-    return jsonify(Categories=[c.serialize for c in categories])
+    count, updated = session.query(func.count(Category.id),
+                                   func.max(Category.updated)).one()
+    # ETag only, as for the feed: a deleted category doesn't change the
+    # newest date
+    etag = getETag(count, updated)
+    if isNotModified(etag, None):
+        return notModified(etag, None)
+    categories = select_categories().order_by(Category.id)
+    if wantsStream():
+        rows = session.execute(categories.execution_options(
+            yield_per=STREAM_BATCH_SIZE))
+        return setValidators(streamRows("Categories", map(
+            serialize_category, rows)), etag, None)
+    return setValidators(jsonify(Categories=[
+        serialize_category(row) for row in session.execute(categories)]),
+        etag, None)
 
 
 @app.route("/api/category/<int:category_id>.json")
 @app.route("/api/category/<int:category_id>")
 def getCategoryAPI(category_id):
-    Catalog = session.query(Category).filter_by(id=category_id).one()
-    CatalogItems = session.query(Item).filter_by(category_id=category_id)
-    return jsonify(Meta=Catalog.serialize,
-                   Items=[i.serialize for i in CatalogItems])
+    updated = session.query(Category.updated).filter_by(
+        id=category_id).one()[0]
+    etag = getETag(updated)
+    if isNotModified(etag, updated):
+        return notModified(etag, updated)
+    Catalog = serialize_category(session.execute(select_categories().where(
+        Category.id == category_id)).one())
+    limit, after = getPageArgs()
+    if wantsStream():
+        # Streams the rest of the category after ``after`` in one response
+        CatalogItems = session.execute(select_items().where(
+            Item.category_id == category_id,
+            Item.id > after).order_by(Item.id).execution_options(
+                yield_per=STREAM_BATCH_SIZE))
+        return setValidators(streamRows("Items", map(serialize_item,
+                                                     CatalogItems),
+                                        meta=Catalog),
+                             etag, updated)
+    CatalogItems, next_after = getItemPage(category_id, limit, after,
+                                           rows=True)
+    if next_after is None:
+        next_url = None
+    else:
+        next_url = url_for("getCategoryAPI", category_id=category_id,
+                           limit=limit, after=next_after)
+    return setValidators(jsonify(Meta=Catalog,
+                                 Items=[serialize_item(row)
+                                        for row in CatalogItems],
+                                 Next=next_url),
+                         etag, updated)
 
 
 @app.route("/api/item/<int:item_id>.json")
 @app.route("/api/item/<int:item_id>")
 def getItemAPI(item_id):
-    SItem = session.query(Item).filter_by(id=item_id).one()
-    return jsonify(SItem.serialize)
+    updated = session.query(Item.updated).filter_by(id=item_id).one()[0]
+    etag = getETag(updated)
+    if isNotModified(etag, updated):
+        return notModified(etag, updated)
+    SItem = session.execute(select_items().where(Item.id == item_id)).one()
+    return setValidators(jsonify(serialize_item(SItem)), etag, updated)
+
+
+def isId(value):
+    return (isinstance(value, int) and not isinstance(value, bool) and
+            value > 0)
+
+
+def isText(value):
+    return isinstance(value, str) and len(value.strip()) > 0
+
+
+@app.route("/api/items.json")
+@app.route("/api/items")
+def getItemsAPI():
+    """Return the items listed in ?ids=1,2,3 (one query for all of them)"""
+    ids = []
+    for part in request.args.get("ids", "").split(","):
+        if not part.strip():
+            continue
+        try:
+            item_id = int(part)
+        except ValueError:
+            return jsonify(Error="Invalid item id: %s" % part), 400
+        if item_id not in ids:
+            ids.append(item_id)
+    if len(ids) > MAX_ITEMS_PER_PAGE:
+        return jsonify(Error="At most %d ids per request" %
+                       MAX_ITEMS_PER_PAGE), 400
+    Items = getItemRows(ids)
+    found = set(row["id"] for row in Items)
+    return jsonify(Items=Items, Missing=[i for i in ids if i not in found])
+
+
+@app.route("/api/items.json", methods=["POST"])
+@app.route("/api/items", methods=["POST"])
+@login_required
+def bulkItemsAPI():
+    """Create and update many items in one transaction
+
+    Expects a JSON array. Objects with an ``id`` update that item (name
+    and/or description, own items only), all others create an item from
+    ``name``, ``description`` and ``category_id``. Invalid entries are
+    reported in ``Results`` without stopping the rest of the batch.
+    """
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        return jsonify(Error="Expected a JSON array of items"), 400
+    if len(rows) > app.config['BULK_MAX_ITEMS']:
+        return jsonify(Error="At most %d items per request" %
+                       app.config['BULK_MAX_ITEMS']), 413
+    # Foreign keys are enforced, so check the author like newItem does
+    if session.query(User.id).filter_by(
+            id=login_session["user_id"]).first() is None:
+        return jsonify(Error="Your account could not be found, please log "
+                       "in again"), 401
+
+    # One query each for every category and item the batch refers to
+    category_ids = set(r.get("category_id") for r in rows
+                       if isinstance(r, dict) and "id" not in r and
+                       isId(r.get("category_id")))
+    item_ids = set(r["id"] for r in rows
+                   if isinstance(r, dict) and isId(r.get("id")))
+    categories = set()
+    if category_ids:
+        categories = set(c for (c,) in session.query(Category.id).filter(
+            Category.id.in_(category_ids)))
+    items = {}
+    if item_ids:
+        items = dict((i.id, i) for i in session.query(Item).filter(
+            Item.id.in_(item_ids)))
+
+    results = []
+    created = []
+    touched = set()
+    for index, row in enumerate(rows):
+        result = {"index": index}
+        results.append(result)
+        if not isinstance(row, dict):
+            result["error"] = "Expected an object"
+        elif "id" in row:
+            result["id"] = row["id"]
+            item = items.get(row["id"]) if isId(row["id"]) else None
+            if item is None:
+                result["error"] = "Item not found"
+            elif item.user_id != login_session["user_id"]:
+                result["error"] = "This is not your item"
+            elif "name" in row and not isText(row["name"]):
+                result["error"] = "Invalid name"
+            elif "description" in row and not isText(row["description"]):
+                result["error"] = "Invalid description"
+            else:
+                if "name" in row:
+                    item.name = row["name"]
+                if "description" in row:
+                    item.description = row["description"]
+                touched.add(item.category_id)
+                result["status"] = "updated"
+        elif not isText(row.get("name")):
+            result["error"] = "Invalid name"
+        elif not isText(row.get("description")):
+            result["error"] = "Invalid description"
+        elif not isId(row.get("category_id")) or \
+                row["category_id"] not in categories:
+            result["error"] = "Category not found"
+        else:
+            created.append((result, {"name": row["name"],
+                                     "description": row["description"],
+                                     "user_id": login_session["user_id"],
+                                     "category_id": row["category_id"]}))
+            touched.add(row["category_id"])
+            result["status"] = "created"
+        if "error" in result:
+            result["status"] = "error"
+
+    session.flush()
+    if touched:
+        session.query(Category).filter(Category.id.in_(touched)).update(
+            {Category.updated: datetime.datetime.utcnow()},
+            synchronize_session=False)
+    if created:
+        # One multi-row INSERT ... RETURNING. SQLite can't promise the
+        # order of the returned rows, which would make it send an INSERT
+        # per row, but numbers the rows of an INSERT in order, so there
+        # the sorted ids are in the order of the batch.
+        in_order = engine.dialect.name != "sqlite"
+        ids = session.execute(
+            insert(Item).returning(Item.id,
+                                   sort_by_parameter_order=in_order),
+            [values for result, values in created]).scalars().all()
+        if not in_order:
+            ids.sort()
+        for (result, values), item_id in zip(created, ids):
+            result["id"] = item_id
+    session.commit()
+    page_cache.invalidate("feed", *["category:%d" % c for c in touched])
+    if feed_events:
+        changed = [r for r in results if r["status"] != "error"]
+        rows = dict((row["id"], row) for row in getItemRows(
+            [r["id"] for r in changed]))
+        for result in changed:
+            publishItemEvent("created" if result["status"] == "created"
+                             else "edited", result["id"],
+                             rows[result["id"]])
+    return jsonify(
+        Results=results,
+        Created=len(created),
+        Updated=len([r for r in results if r["status"] == "updated"]),
+        Errors=len([r for r in results if r["status"] == "error"]))
+
+
+def getSearchPage(rows=False):
+    """Run the search given by ?q= and ?page=, return the matching items
+    (API rows with ``rows``) and the page number of the next page (None on
+    the last page)"""
+    terms = request.args.get("q", "")
+    page = max(1, request.args.get("page", 1, type=int))
+    limit = max(1, min(request.args.get("limit", ITEMS_PER_PAGE, type=int),
+                       MAX_ITEMS_PER_PAGE))
+    if rows:
+        ids = search_item_ids(session, terms, limit + 1, (page - 1) * limit)
+        next_page = page + 1 if len(ids) > limit else None
+        return terms, limit, getItemRows(ids[:limit]), next_page
+    items = search_items(session, terms, limit + 1, (page - 1) * limit)
+    if len(items) > limit:
+        return terms, limit, items[:limit], page + 1
+    return terms, limit, items, None
+
+
+@app.route("/api/cache.json")
+@app.route("/api/cache")
+def pageCacheAPI():
+    return jsonify(page_cache.stats())
+
+
+@app.route("/api/search.json")
+@app.route("/api/search")
+def searchAPI():
+    terms, limit, Results, next_page = getSearchPage(rows=True)
+    if next_page is None:
+        next_url = None
+    else:
+        next_url = url_for("searchAPI", q=terms, limit=limit, page=next_page)
+    return jsonify(Query=terms,
+                   Items=Results,
+                   Next=next_url)
+
+
+@app.route("/search")
+@app.route("/search/index")
+def search():
+    terms, limit, Results, next_page = getSearchPage()
+    if next_page is None:
+        next_url = None
+    else:
+        next_url = url_for("search", q=terms, limit=limit, page=next_page)
+    return render_template("search.html",
+                           terms=terms,
+                           items=Results,
+                           next_url=next_url,
+                           login_session=login_session)
 
 
 @app.route("/category/<int:category_id>")
 @app.route("/category/<int:category_id>/index")
 def showCategory(category_id):
     try:
-        Items = session.query(Item).filter_by(
-            category_id=category_id).order_by(Item.id)
         CategoryMeta = session.query(Category).filter_by(id=category_id).one()
     except NoResultFound:
         flash("The requested item was not found!")
         return redirect("/", code=302)
     else:
-        return render_template("category.html",
-                               items=Items,
-                               category=CategoryMeta,
-                               login_session=login_session)
+        if not isAnonymous():
+            return renderCategory(CategoryMeta)
+        return cachedPage(getETag(CategoryMeta.updated),
+                          CategoryMeta.updated,
+                          ("category:%d" % category_id,),
+                          lambda: renderCategory(CategoryMeta))
+
+
+def renderCategory(CategoryMeta):
+    limit, after = getPageArgs()
+    Items, next_after = getItemPage(CategoryMeta.id, limit, after)
+    if next_after is None:
+        next_url = None
+    else:
+        next_url = url_for("showCategory", category_id=CategoryMeta.id,
+                           limit=limit, after=next_after)
+    return render_template("category.html",
+                           items=Items,
+                           category=CategoryMeta,
+                           next_url=next_url,
+                           login_session=login_session)
 
 
 @app.route("/category/<int:category_id>/<int:item_id>")
 @app.route("/category/<int:category_id>/<int:item_id>/index")
 def showItem(category_id, item_id):
     try:
-        SearchedItem = session.query(Item).filter_by(
-            category_id=category_id, id=item_id).one()
+        if not isAnonymous():
+            return renderItem(category_id, item_id)
+        item_updated, category_updated = session.query(
+            Item.updated, Category.updated).join(Item.category).filter(
+            Item.category_id == category_id, Item.id == item_id).one()
     except NoResultFound:
         flash("The requested item was not found!")
         return redirect("/", code=302)
     else:
-        return render_template("item.html",
-                               item=SearchedItem,
-                               login_session=login_session)
+        return cachedPage(getETag(item_updated, category_updated),
+                          max(item_updated, category_updated),
+                          ("item:%d" % item_id, "category:%d" % category_id),
+                          lambda: renderItem(category_id, item_id))
+
+
+def renderItem(category_id, item_id):
+    SearchedItem = session.query(Item).options(
+        joinedload(Item.user), joinedload(Item.category)).filter_by(
+        category_id=category_id, id=item_id).one()
+    return render_template("item.html",
+                           item=SearchedItem,
+                           login_session=login_session)
 
 
 @app.route("/category/<int:category_id>/<int:item_id>/edit",
@@ -250,12 +1106,22 @@ def editItem(category_id, item_id):
     else:
         if(login_session["user_id"] == SearchedItem.user_id):
             if(request.method == "POST"):
-                if(request.form["name"]):
-                    SearchedItem.name = request.form["name"]
-                if(request.form["description"]):
-                    SearchedItem.description = request.form["description"]
-                session.add(SearchedItem)
-                session.commit()
+                name = request.form["name"]
+                description = request.form["description"]
+
+                def edit(db):
+                    EditedItem = db.get(Item, item_id)
+                    if(name):
+                        EditedItem.name = name
+                    if(description):
+                        EditedItem.description = description
+                    touchCategory(category_id, db)
+                    db.flush()
+                    # Taken before the commit expires the item
+                    return EditedItem.serialize
+                data = runWrite(edit)
+                page_cache.invalidate("feed", "category:%d" % category_id)
+                publishItemEvent("edited", item_id, data)
                 flash("The item has been edited!")
                 return redirect("/category/" +
                                 str(category_id)+"/"+str(item_id),
@@ -285,7 +1151,11 @@ def deleteItem(category_id, item_id):
     else:
         if(login_session["user_id"] == DeletedItem.user_id):
             session.delete(DeletedItem)
+            touchCategory(category_id)
             session.commit()
+            page_cache.invalidate("feed", "category:%d" % category_id)
+            publishItemEvent("deleted", item_id,
+                             {"id": item_id, "category_id": category_id})
             flash("The item has been deleted!")
             return redirect("/category/"+str(category_id),
                             code=302)
@@ -300,16 +1170,33 @@ def deleteItem(category_id, item_id):
 @login_required
 def newItem(category_id):
     if(request.method == "POST"):
+        # Foreign keys are enforced, so check them instead of failing
+        if session.query(Category.id).filter_by(
+                id=category_id).first() is None:
+            flash("The requested category could not be found!")
+            return redirect("/feed", code=302)
+        if session.query(User.id).filter_by(
+                id=login_session["user_id"]).first() is None:
+            flash("Your account could not be found, please log in again!")
+            return redirect("/login", code=302)
         if request.form["name"] and request.form["description"]:
-            NewItem = Item(name=request.form["name"],
-                           description=request.form["description"],
-                           user_id=login_session["user_id"],
-                           category_id=category_id)
-            session.add(NewItem)
-            session.commit()
+            values = dict(name=request.form["name"],
+                          description=request.form["description"],
+                          user_id=login_session["user_id"],
+                          category_id=category_id)
+
+            def create(db):
+                NewItem = Item(**values)
+                db.add(NewItem)
+                touchCategory(category_id, db)
+                db.flush()
+                return NewItem.serialize
+            data = runWrite(create)
+            page_cache.invalidate("feed", "category:%d" % category_id)
+            publishItemEvent("created", data["id"], data)
             flash("Your new item has been created!")
             return redirect("/category/" +
-                            str(category_id)+"/"+str(NewItem.id),
+                            str(category_id)+"/"+str(data["id"]),
                             code=302)
         else:
             flash("Please submit all the required data!")
@@ -332,13 +1219,18 @@ def newItem(category_id):
 def createCategory():
     if(request.method == "POST"):
         if request.form["name"] and request.form["description"]:
-            NewCat = Category(name=request.form[
-                              "name"],
-                              description=request.form["description"])
-            session.add(NewCat)
-            session.commit()
+            name = request.form["name"]
+            description = request.form["description"]
+
+            def create(db):
+                NewCat = Category(name=name, description=description)
+                db.add(NewCat)
+                db.flush()
+                return NewCat.id
+            category_id = runWrite(create)
+            page_cache.invalidate("feed")
             flash("The category has been created!")
-            return redirect("/category/"+str(NewCat.id), code=302)
+            return redirect("/category/"+str(category_id), code=302)
         else:
             flash("Please submit all the required data!")
             return redirect("/category/new", code=302)
@@ -359,10 +1251,15 @@ def editCategory(category_id):
     else:
         if(request.method == "POST"):
             if request.form["name"] and request.form["description"]:
-                Cat.name = request.form["name"]
-                Cat.description = request.form["description"]
-                session.add(Cat)
-                session.commit()
+                name = request.form["name"]
+                description = request.form["description"]
+
+                def edit(db):
+                    EditedCat = db.get(Category, category_id)
+                    EditedCat.name = name
+                    EditedCat.description = description
+                runWrite(edit)
+                page_cache.invalidate("feed", "category:%d" % category_id)
                 flash("The category has been edited!")
                 return redirect("/category/"+str(category_id), code=302)
             else:
@@ -375,6 +1272,56 @@ def editCategory(category_id):
                                    category=Cat)
 
 
+# Categories being deleted in the background by this process
+deleting_categories = set()
+deleting_lock = threading.Lock()
+
+
+def isLargeCategory(category_id):
+    threshold = app.config['BACKGROUND_DELETE_THRESHOLD']
+    if not threshold:
+        return False
+    return session.query(Item.id).filter_by(
+        category_id=category_id).offset(threshold).first() is not None
+
+
+def deleteCategoryInBatches(category_id):
+    """Delete a category's items a batch per transaction, then the category
+
+    Each commit only holds the write lock for one batch, so other requests
+    keep going while a huge category is removed. If the process stops
+    half way, deleting the category again picks up where this left off.
+    """
+    batch_size = app.config['DELETE_BATCH_SIZE']
+    batch_session = DBSession()
+    try:
+        while True:
+            ids = batch_session.query(Item.id).filter_by(
+                category_id=category_id).limit(batch_size).subquery()
+            deleted = batch_session.query(Item).filter(
+                Item.id.in_(ids.select())).delete(synchronize_session=False)
+            batch_session.query(Category).filter_by(id=category_id).update(
+                {Category.updated: datetime.datetime.utcnow()},
+                synchronize_session=False)
+            batch_session.commit()
+            page_cache.invalidate("category:%d" % category_id)
+            if deleted < batch_size:
+                break
+            # sqlite3 never yields to other greenlets, so under gevent
+            # workers (see the Procfile) this thread is a greenlet that
+            # would hold up the whole worker until the last batch. A real
+            # sleep, as sleep(0) doesn't give greenlets waiting on timers
+            # a turn.
+            time.sleep(0.001)
+        batch_session.query(Category).filter_by(id=category_id).delete()
+        batch_session.commit()
+        page_cache.invalidate("feed", "category:%d" % category_id)
+    finally:
+        batch_session.close()
+        with deleting_lock:
+            deleting_categories.discard(category_id)
+
+
 @app.route("/category/<int:category_id>/delete")
 @app.route("/category/<int:category_id>/delete/index")
 @login_required
@@ -385,11 +1332,21 @@ def deleteCategory(category_id):
         flash("The requested category can't be found!")
         return redirect("/feed", code=302)
     else:
-        Items = session.query(Item).filter_by(category_id=category_id)
-        for i in Items:
-            session.delete(i)
+        if isLargeCategory(category_id):
+            with deleting_lock:
+                started = category_id not in deleting_categories
+                deleting_categories.add(category_id)
+            if started:
+                worker = threading.Thread(target=deleteCategoryInBatches,
+                                          args=(category_id,))
+                worker.daemon = True
+                worker.start()
+            flash("The category is being deleted!")
+            return redirect("/feed", code=302)
+        # The items go with it through ON DELETE CASCADE
         session.delete(Cat)
         session.commit()
+        page_cache.invalidate("feed", "category:%d" % category_id)
         flash("The category has been deleted!")
         return redirect("/feed", code=302)
 
@@ -413,7 +1370,7 @@ def showLoggedIn():
 @app.route('/login/google')
 @app.route('/login/google/index')
 def showGoogleLogin():
-    return google.authorize(
+    return getOAuthApp("google").authorize(
         callback=url_for('googleAuthorized',
                          _external=True)
     )
@@ -422,7 +1379,7 @@ def showGoogleLogin():
 @app.route("/login/github")
 @app.route("/login/github/index")
 def showGithubLogin():
-    return github.authorize(
+    return getOAuthApp("github").authorize(
         callback=url_for('githubAuthorized',
                          _external=True)
     )
@@ -436,14 +1393,22 @@ def showFacebookLogin():
         next=request.args.get('next') or request.referrer or None,
         _external=True
     )
-    return facebook.authorize(callback=callback)
+    return getOAuthApp("facebook").authorize(callback=callback)
+
+
+def regenerateSession():
+    """Give the session a new id when the logged in user changes (signed
+    cookie sessions carry their data, so they have no id to plant)"""
+    if hasattr(login_session, "regenerate"):
+        login_session.regenerate()
 
 
 @app.route("/login/github/authorized")
 @app.route("/login/github/authorized/index")
 def githubAuthorized():
+    from flask_oauthlib.client import OAuthException
     try:
-        resp = github.authorized_response()
+        resp = getOAuthApp("github").authorized_response()
     except OAuthException:
         flash("An error occured while authorizing with GitHub!")
         return redirect("/login", code=302)
@@ -454,8 +1419,14 @@ def githubAuthorized():
             resp
         ))
         return redirect("/login", code=302)
-    login_session["token"] = (resp['access_token'], '')
-    me = github.get('user')
+    token = (resp['access_token'], '')
+    try:
+        me = getOAuthApp("github").get('user', token=token)
+    except OAuthException:
+        flash("An error occured while authorizing with GitHub!")
+        return redirect("/login", code=302)
+    regenerateSession()
+    login_session["token"] = token
     login_session["provider"] = "github"
     login_session["email"] = "github-"+me.data["login"]+"@users.item-catalog"
     if(me.data["email"] is None):
@@ -479,8 +1450,9 @@ def githubAuthorized():
 @app.route('/login/facebook/authorized')
 @app.route('/login/facebook/authorized/index')
 def facebookAuthorized():
+    from flask_oauthlib.client import OAuthException
     try:
-        resp = facebook.authorized_response()
+        resp = getOAuthApp("facebook").authorized_response()
     except OAuthException:
         flash("An error occured while authorizing with Facebook!")
         return redirect("/login", code=302)
@@ -494,9 +1466,15 @@ def facebookAuthorized():
     if isinstance(resp, OAuthException):
         return 'Access denied: %s' % resp.message
 
+    token = (resp['access_token'], '')
+    try:
+        me = getOAuthApp("facebook").get('/me', token=token)
+    except OAuthException:
+        flash("An error occured while authorizing with Facebook!")
+        return redirect("/login", code=302)
     login_session["provider"] = "facebook"
-    login_session["token"] = (resp['access_token'], '')
-    me = facebook.get('/me')
+    regenerateSession()
+    login_session["token"] = token
     login_session["email"] = ""
     login_session["picture"] = "/static/blank_user.gif"
 
@@ -524,8 +1502,9 @@ def facebookAuthorized():
 @app.route('/login/google/authorized')
 @app.route('/login/google/authorized/index')
 def googleAuthorized():
+    from flask_oauthlib.client import OAuthException
     try:
-        resp = google.authorized_response()
+        resp = getOAuthApp("google").authorized_response()
     except OAuthException:
         flash("An error occured while authorizing with Google!")
         return redirect("/login", code=302)
@@ -536,11 +1515,17 @@ def googleAuthorized():
             resp
         ))
         return redirect("/login", code=302)
+    token = (resp['access_token'], '')
+    try:
+        me = getOAuthApp("google").get('userinfo', token=token)
+    except OAuthException:
+        flash("An error occured while authorizing with Google!")
+        return redirect("/login", code=302)
     login_session["provider"] = "google"
-    login_session["token"] = (resp['access_token'], '')
+    regenerateSession()
+    login_session["token"] = token
     # checkUser(login_session)
     # login_session["user_id"] = getUserID(login_session["email"])
-    me = google.get('userinfo')
     if(me.data["email"] is None):
         login_session["email"] = ""
     else:
@@ -564,13 +1549,43 @@ def googleAuthorized():
 # User Helper Functions
 
 
+# email -> user id of recent logins, so a returning user costs no query
+user_id_cache = LRUCache(app.config['USER_CACHE_SIZE'])
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def forget_user(mapper, connection, target):
+    user_id_cache.pop(target.email)
+
+
 def createUser(login_session):
-    newUser = User(name=login_session['username'], email=login_session[
-                   'email'], picture="")
-    session.add(newUser)
+    """Return the id of the user with the session's email, creating the user
+    if needed, in a single statement
+
+    The insert relies on the unique email index, so concurrent first logins
+    of the same user can't create duplicates.
+    """
+    values = {"name": login_session['username'],
+              "email": login_session['email'],
+              "picture": ""}
+    if engine.dialect.name != "sqlite":
+        user_id = getUserID(values["email"])
+        if user_id is None:
+            newUser = User(**values)
+            session.add(newUser)
+            session.commit()
+            user_id = newUser.id
+        return user_id
+    insert = sqlite_insert(User).values(**values)
+    # DO UPDATE (with an unchanged value) rather than DO NOTHING, so that
+    # RETURNING also yields the id of an existing user
+    insert = insert.on_conflict_do_update(
+        index_elements=[User.email],
+        set_={"email": insert.excluded.email}).returning(User.id)
+    user_id = session.execute(insert).scalar()
     session.commit()
-    user = session.query(User).filter_by(email=login_session['email']).one()
-    return user.id
+    return user_id
 
 
 def getUserInfo(user_id):
@@ -582,15 +1597,16 @@ def getUserID(email):
     try:
         user = session.query(User).filter_by(email=email).one()
         return user.id
-    except:
+    except NoResultFound:
         return None
 
 
 def checkUser(ls):
-    if getUserID(ls["email"]) is None:
-        return createUser(ls)
-    else:
-        return getUserID(ls["email"])
+    user_id = user_id_cache.get(ls["email"])
+    if user_id is None:
+        user_id = createUser(ls)
+        user_id_cache.set(ls["email"], user_id)
+    return user_id
 
 
 # Disconnect based on provider
@@ -598,6 +1614,7 @@ def checkUser(ls):
 @app.route('/logout/index')
 def logout():
     if(login_session["token"]):
+        regenerateSession()
         del login_session["user_id"]
         del login_session["token"]
         del login_session["username"]
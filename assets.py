@@ -0,0 +1,141 @@
+"""Fingerprinted, precompressed static assets
+
+    python assets.py build
+
+copies every file under static/ to static/build/ with a hash of its
+content in the name (mdb/css/mdb.min.css -> mdb/css/mdb.min.1a2b3c4d5e.css),
+points relative url()s in stylesheets at the fingerprinted files, writes
+.gz (and .br, if brotli is installed) variants of everything compressible
+and a manifest.json mapping the original paths to the built ones.
+
+Templates link assets through asset_url(), which uses the manifest if a
+build exists and the plain /static/ URL otherwise. Built files never
+change under their name, so they are served as immutable.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import sys
+from flask import send_from_directory
+from compression import COMPRESSIBLE_MIMETYPES, ENCODINGS, compress, negotiate
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "static")
+BUILD_DIR = os.path.join(STATIC_DIR, "build")
+MANIFEST = "manifest.json"
+MAX_AGE = 365 * 24 * 60 * 60
+
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+PRECOMPRESSED_MIMETYPES = COMPRESSIBLE_MIMETYPES + (
+    "font/ttf", "font/otf", "application/vnd.ms-fontobject",
+    "application/x-font-ttf", "application/font-sfnt",
+)
+CSS_URL = re.compile(r"""url\((['"]?)([^'")]+)\1\)""")
+
+
+def fingerprint(path, data):
+    name, ext = posixpath.splitext(path)
+    return "%s.%s%s" % (name, hashlib.sha1(data).hexdigest()[:10], ext)
+
+
+def rewrite_css(path, data, manifest):
+    """Point relative url()s in the stylesheet at ``path`` to the built
+    files, keeping any ?query or #fragment"""
+    directory = posixpath.dirname(path)
+
+    def replace(match):
+        quote, url = match.groups()
+        if ":" in url or url.startswith(("/", "#")):
+            return match.group(0)
+        end = len(url)
+        for mark in "?#":
+            if mark in url:
+                end = min(end, url.index(mark))
+        target = posixpath.normpath(posixpath.join(directory, url[:end]))
+        if target not in manifest:
+            return match.group(0)
+        built = posixpath.relpath(manifest[target], directory or ".")
+        return "url(%s%s%s%s)" % (quote, built, url[end:], quote)
+
+    return CSS_URL.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+
+def build(static_dir=STATIC_DIR, build_dir=BUILD_DIR, level=9):
+    """Rebuild ``build_dir`` from ``static_dir`` and return the manifest"""
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    paths = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs
+                         if os.path.join(root, d) != build_dir)
+        for name in sorted(files):
+            path = os.path.relpath(os.path.join(root, name), static_dir)
+            paths.append(path.replace(os.sep, "/"))
+    # Stylesheets last, so the files they refer to are already in the
+    # manifest when their url()s are rewritten
+    paths.sort(key=lambda p: p.endswith(".css"))
+
+    manifest = {}
+    for path in paths:
+        with open(os.path.join(static_dir, path), "rb") as f:
+            data = f.read()
+        if path.endswith(".css"):
+            data = rewrite_css(path, data, manifest)
+        manifest[path] = fingerprint(path, data)
+        target = os.path.join(build_dir, manifest[path])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(data)
+        if mimetypes.guess_type(path)[0] not in PRECOMPRESSED_MIMETYPES:
+            continue
+        for encoding in ENCODINGS:
+            compressed = compress(data, encoding, level)
+            # Not worth a variant if it barely shrinks
+            if len(compressed) < len(data) * 0.9:
+                with open(target + SUFFIXES[encoding], "wb") as f:
+                    f.write(compressed)
+    with open(os.path.join(build_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(build_dir=BUILD_DIR):
+    """Return the manifest of the last build, or {} if there is none"""
+    try:
+        with open(os.path.join(build_dir, MANIFEST), "r") as f:
+            return json.load(f)
+    except IOError:
+        return {}
+
+
+def send_asset(filename, accept_encodings, build_dir=BUILD_DIR):
+    """Send a built file, or its precompressed variant if the client
+    accepts it (served even without the brotli module)"""
+    available = [e for e in SUFFIXES if os.path.isfile(
+        os.path.join(build_dir, filename + SUFFIXES[e]))]
+    encoding = negotiate(accept_encodings, available)
+    mimetype = mimetypes.guess_type(filename)[0]
+    if encoding is None:
+        response = send_from_directory(build_dir, filename,
+                                       mimetype=mimetype, max_age=MAX_AGE)
+    else:
+        response = send_from_directory(build_dir,
+                                       filename + SUFFIXES[encoding],
+                                       mimetype=mimetype, max_age=MAX_AGE)
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        print("Usage: python assets.py build")
+        sys.exit(1)
+    manifest = build()
+    print("Built %d assets into %s" % (len(manifest), BUILD_DIR))
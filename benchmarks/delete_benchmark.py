@@ -0,0 +1,87 @@
+"""Time deleting a large category three ways
+
+- orm: the old route, loading every item and deleting it one by one
+- cascade: one DELETE of the category, items go via ON DELETE CASCADE
+- batched: the background mode, one transaction per batch of items
+
+Each run works on a fresh copy of the same generated database and
+reports the total time and the longest single transaction (how long
+other writers were locked out):
+    python -m benchmarks.delete_benchmark [items] [batch-size]
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from sqlalchemy.orm import sessionmaker
+from database_setup import Category, Item, create_db_engine
+from benchmarks.generate import generate
+
+
+def delete_orm(session, category_id, batch_size):
+    start = time.perf_counter()
+    for item in session.query(Item).filter_by(category_id=category_id):
+        session.delete(item)
+    session.delete(session.get(Category, category_id))
+    session.commit()
+    return time.perf_counter() - start
+
+
+def delete_cascade(session, category_id, batch_size):
+    start = time.perf_counter()
+    session.query(Category).filter_by(id=category_id).delete()
+    session.commit()
+    return time.perf_counter() - start
+
+
+def delete_batched(session, category_id, batch_size):
+    longest = 0
+    while True:
+        start = time.perf_counter()
+        ids = session.query(Item.id).filter_by(
+            category_id=category_id).limit(batch_size).subquery()
+        deleted = session.query(Item).filter(Item.id.in_(
+            ids.select())).delete(synchronize_session=False)
+        session.commit()
+        longest = max(longest, time.perf_counter() - start)
+        if deleted < batch_size:
+            break
+    start = time.perf_counter()
+    session.query(Category).filter_by(id=category_id).delete()
+    session.commit()
+    return max(longest, time.perf_counter() - start)
+
+
+def main(items=100000, batch_size=5000):
+    template = tempfile.mktemp(suffix=".db")
+    engine = create_db_engine("sqlite:///" + template)
+    generate(engine, users=10, categories=1, items=items)
+    engine.dispose()
+    results = {"items": items, "batch_size": batch_size}
+    try:
+        for name, delete in (("orm", delete_orm),
+                             ("cascade", delete_cascade),
+                             ("batched", delete_batched)):
+            path = tempfile.mktemp(suffix=".db")
+            shutil.copy(template, path)
+            engine = create_db_engine("sqlite:///" + path)
+            session = sessionmaker(bind=engine)()
+            start = time.perf_counter()
+            longest = delete(session, 1, batch_size)
+            total = time.perf_counter() - start
+            left = session.query(Item).count()
+            session.close()
+            engine.dispose()
+            os.remove(path)
+            results[name] = {"seconds": round(total, 3),
+                             "longest_transaction_s": round(longest, 3),
+                             "items_left": left}
+    finally:
+        os.remove(template)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,77 @@
+"""A local stand-in for an OAuth2 provider (GitHub flavoured)
+
+Answers the token exchange and the ``user`` profile request after a
+configurable delay, and counts the TCP connections it accepted so that
+connection reuse can be checked:
+    python -m benchmarks.fake_oauth [port] [delay-seconds]
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, data):
+        time.sleep(self.server.delay)
+        body = json.dumps(data).encode("utf-8")
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting
+            self.close_connection = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.reply({"access_token": "fake-token", "token_type": "bearer",
+                    "scope": "user:email"})
+
+    def do_GET(self):
+        self.reply({"login": "fake", "name": "Fake User",
+                    "email": "fake@users.item-catalog",
+                    "html_url": "http://localhost/fake",
+                    "avatar_url": "/static/blank_user.gif"})
+
+
+class FakeProvider(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, delay=0.0):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", port),
+                                     FakeProviderHandler)
+        self.delay = delay
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/" % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    server = FakeProvider(int(args[0]) if args else 8111,
+                          float(args[1]) if len(args) > 1 else 0.0)
+    print("Fake OAuth provider on %s" % server.url)
+    server.serve_forever()
@@ -0,0 +1,98 @@
+"""Fill a database with a synthetic catalog
+
+Rows are written with executemany() in large batches, so a catalog of a
+million items takes seconds rather than hours:
+    python -m benchmarks.generate --categories 1000 --items 1000000
+
+Item names and descriptions are made-up words, each common enough to be
+searchable but rare enough that a search only matches a few rows.
+"""
+import argparse
+import datetime
+import json
+import random
+import time
+from sqlalchemy import func, select
+from database_setup import User, Category, Item, create_db_engine
+from migrations import upgrade
+from search import drop_search_triggers, rebuild_search_index
+from item_counts import drop_item_count_triggers, reconcile_item_counts
+from config import DEFAULTS, from_env
+
+SYLLABLES = ("ba be bi bo ku ka ri ro sa se ta to ne ni ma mo "
+             "la lu pe po").split()
+# 8000 made-up three syllable words
+WORDS = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+
+BATCH_SIZE = 10000
+
+
+def insert_batches(conn, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+
+
+def generate(engine, users=100, categories=1000, items=1000000, seed=42):
+    """Append ``users``, ``categories`` and ``items`` rows and return how
+    many of each were written and how long it took"""
+    rnd = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    start = time.perf_counter()
+    upgrade(engine)
+    with engine.begin() as conn:
+        # Indexing and counting the whole load at once is much faster
+        # than row by row
+        drop_search_triggers(conn)
+        drop_item_count_triggers(conn)
+        first_user = conn.execute(select(func.max(User.id))).scalar() or 0
+        first_category = conn.execute(
+            select(func.max(Category.id))).scalar() or 0
+        insert_batches(conn, User.__table__, (
+            {"id": first_user + n,
+             "name": "User %d" % (first_user + n),
+             "email": "user%d@bench.item-catalog" % (first_user + n),
+             "picture": ""}
+            for n in range(1, users + 1)))
+        insert_batches(conn, Category.__table__, (
+            {"id": first_category + n,
+             "name": rnd.choice(WORDS).title(),
+             "description": " ".join(rnd.sample(WORDS, 6)),
+             "updated": now}
+            for n in range(1, categories + 1)))
+        insert_batches(conn, Item.__table__, (
+            {"name": " ".join(rnd.sample(WORDS, 2)).title(),
+             "description": " ".join(rnd.sample(WORDS, 12)),
+             "user_id": first_user + rnd.randint(1, users),
+             "category_id": first_category + rnd.randint(1, categories),
+             "created": now,
+             "updated": now}
+            for _ in range(items)))
+        reconcile_item_counts(conn)
+    rebuild_search_index(engine)
+    return {"users": users, "categories": categories, "items": items,
+            "seconds": round(time.perf_counter() - start, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database",
+                        default=from_env("DATABASE_URL",
+                                         DEFAULTS["DATABASE_URL"]))
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--categories", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    engine = create_db_engine(args.database)
+    print(json.dumps(generate(engine, args.users, args.categories,
+                              args.items, args.seed)))
+
+
+if __name__ == '__main__':
+    main()
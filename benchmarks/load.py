@@ -0,0 +1,226 @@
+"""Mixed read/write load driver
+
+Runs a weighted mix of requests from several threads, either in-process
+through the Flask test client or against a running server (e.g. a local
+gunicorn), and prints per-route throughput and latency percentiles as
+JSON so runs can be diffed between commits:
+    python -m benchmarks.generate --database sqlite:///bench.db
+    CATALOG_DATABASE_URL=sqlite:///bench.db \\
+        python -m benchmarks.load --scenario mixed --threads 8
+    python -m benchmarks.load --url http://127.0.0.1:8000 --database \\
+        sqlite:///bench.db
+
+Writes are made as the owner of the sampled items. Against a server this
+stores a login session in CATALOG_SESSION_DATABASE_URL, which has to be
+the server's, or with CATALOG_SESSION_BACKEND=cookie signs one with
+CATALOG_SECRET_KEY, which has to match the server's.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from sqlalchemy import select
+from database_setup import Item, create_db_engine
+from config import DEFAULTS, from_env
+
+# name: (method, url pattern, weight per scenario)
+ROUTES = {
+    "index": ("GET", "/feed",
+              {"read": 20, "mixed": 20, "write": 0}),
+    "showCategory": ("GET", "/category/{category_id}",
+                     {"read": 20, "mixed": 18, "write": 0}),
+    "showItem": ("GET", "/category/{category_id}/{item_id}",
+                 {"read": 25, "mixed": 22, "write": 0}),
+    "categoriesJson": ("GET", "/api/categories.json",
+                       {"read": 5, "mixed": 5, "write": 0}),
+    "getCategoryAPI": ("GET", "/api/category/{category_id}.json",
+                       {"read": 15, "mixed": 13, "write": 0}),
+    "getItemAPI": ("GET", "/api/item/{item_id}.json",
+                   {"read": 15, "mixed": 12, "write": 0}),
+    "newItem": ("POST", "/category/{category_id}/new",
+                {"read": 0, "mixed": 5, "write": 50}),
+    "editItem": ("POST", "/category/{category_id}/{item_id}/edit",
+                 {"read": 0, "mixed": 5, "write": 50}),
+}
+SAMPLE_SIZE = 10000
+
+
+def sample_items(database):
+    """Pick items owned by one user, so every edit is allowed"""
+    engine = create_db_engine(database)
+    with engine.connect() as conn:
+        user_id = conn.execute(select(Item.user_id).order_by(
+            Item.id).limit(1)).scalar()
+        rows = conn.execute(select(Item.id, Item.category_id).where(
+            Item.user_id == user_id).limit(SAMPLE_SIZE)).fetchall()
+    engine.dispose()
+    if not rows:
+        raise SystemExit("No items found, run benchmarks.generate first")
+    return user_id, [tuple(r) for r in rows]
+
+
+def login_session(user_id):
+    return {"username": "bench", "user_id": user_id,
+            "token": ["bench", ""], "provider": "bench",
+            "email": "bench@bench.item-catalog", "picture": "", "link": ""}
+
+
+class TestClientTarget(object):
+    """Send requests through the Flask test client of this process"""
+
+    def __init__(self, user_id):
+        import app
+        self.app = app.app
+        self.user_id = user_id
+
+    def client(self):
+        reader = self.app.test_client()
+        writer = self.app.test_client()
+        with writer.session_transaction() as session:
+            session.update(login_session(self.user_id))
+
+        def send(method, url, data, write):
+            client = writer if write else reader
+            return client.open(url, method=method, data=data).status_code
+        return send
+
+
+class HTTPTarget(object):
+    """Send requests to a running server"""
+
+    def __init__(self, base_url, user_id):
+        self.base_url = base_url.rstrip("/")
+        backend = from_env("SESSION_BACKEND", DEFAULTS["SESSION_BACKEND"])
+        if backend == "sqlite":
+            from sessions import ServerSessionInterface, SQLiteSessionStore
+            interface = ServerSessionInterface(SQLiteSessionStore(
+                create_db_engine(from_env(
+                    "SESSION_DATABASE_URL",
+                    DEFAULTS["SESSION_DATABASE_URL"]))))
+            self.cookie = interface.new_sid()
+            interface.store.set(
+                self.cookie,
+                interface.serializer.dumps(login_session(user_id)),
+                time.time() + interface.ttl)
+        elif backend == "cookie":
+            from flask import Flask
+            app = Flask(__name__)
+            app.secret_key = from_env("SECRET_KEY", DEFAULTS["SECRET_KEY"])
+            serializer = app.session_interface.get_signing_serializer(app)
+            self.cookie = serializer.dumps(login_session(user_id))
+        else:
+            raise SystemExit("Can't log in to a server keeping its sessions "
+                             "in memory, use the sqlite or cookie backend")
+
+    def client(self):
+        import requests
+        reader = requests.Session()
+        writer = requests.Session()
+        writer.cookies.set("session", self.cookie)
+
+        def send(method, url, data, write):
+            client = writer if write else reader
+            return client.request(method, self.base_url + url, data=data,
+                                   allow_redirects=False).status_code
+        return send
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return round(values[index] * 1000, 3)
+
+
+def run(target, items, scenario="mixed", threads=4, duration=10.0,
+        seed=42):
+    names = [n for n in ROUTES if ROUTES[n][2][scenario]]
+    weights = [ROUTES[n][2][scenario] for n in names]
+    latencies = dict((n, []) for n in names)
+    errors = dict((n, 0) for n in names)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(number):
+        rnd = random.Random(seed + number)
+        send = target.client()
+        local = dict((n, []) for n in names)
+        failed = dict((n, 0) for n in names)
+        while time.perf_counter() < deadline:
+            name = rnd.choices(names, weights)[0]
+            method, pattern = ROUTES[name][:2]
+            item_id, category_id = rnd.choice(items)
+            url = pattern.format(item_id=item_id, category_id=category_id)
+            data = None
+            if method == "POST":
+                data = {"name": "Bench %d" % rnd.randint(0, 10 ** 6),
+                        "description": "Written by benchmarks.load"}
+            start = time.perf_counter()
+            try:
+                status = send(method, url, data, method == "POST")
+            except Exception:
+                status = 599
+            local[name].append(time.perf_counter() - start)
+            if status >= 400:
+                failed[name] += 1
+        with lock:
+            for n in names:
+                latencies[n].extend(local[n])
+                errors[n] += failed[n]
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,))
+            for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    routes = {}
+    for n in names:
+        routes[n] = {"requests": len(latencies[n]),
+                     "errors": errors[n],
+                     "rps": round(len(latencies[n]) / elapsed, 2),
+                     "p50_ms": percentile(latencies[n], 50),
+                     "p95_ms": percentile(latencies[n], 95),
+                     "p99_ms": percentile(latencies[n], 99)}
+    every = [v for n in names for v in latencies[n]]
+    return {"scenario": scenario, "threads": threads,
+            "seconds": round(elapsed, 2),
+            "total": {"requests": len(every),
+                      "errors": sum(errors.values()),
+                      "rps": round(len(every) / elapsed, 2),
+                      "p50_ms": percentile(every, 50),
+                      "p95_ms": percentile(every, 95),
+                      "p99_ms": percentile(every, 99)},
+            "routes": routes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database",
+                        default=from_env("DATABASE_URL",
+                                         DEFAULTS["DATABASE_URL"]),
+                        help="database to sample item ids from")
+    parser.add_argument("--url", help="base URL of a running server; "
+                        "defaults to the in-process test client")
+    parser.add_argument("--scenario", default="mixed",
+                        choices=["read", "mixed", "write"])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    user_id, items = sample_items(args.database)
+    if args.url:
+        target = HTTPTarget(args.url, user_id)
+    else:
+        target = TestClientTarget(user_id)
+    print(json.dumps(run(target, items, args.scenario, args.threads,
+                         args.duration, args.seed), indent=2))
+
+
+if __name__ == '__main__':
+    main()
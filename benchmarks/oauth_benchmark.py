@@ -0,0 +1,81 @@
+"""Measure how long OAuth callbacks occupy a worker when the provider is
+slow
+
+Points the GitHub client at a local stand-in provider and runs
+concurrent ``/login/github/authorized`` callbacks for a fast and a slow
+provider. With the pooled transport a callback holds its worker for at
+most the configured timeouts, however slow the provider is:
+    python -m benchmarks.oauth_benchmark [logins] [slow-delay-seconds]
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from benchmarks.fake_oauth import FakeProvider
+
+
+def run(app_module, provider, logins):
+    durations = []
+    outcomes = {"loggedin": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def login():
+        client = app_module.app.test_client()
+        start = time.perf_counter()
+        try:
+            response = client.get("/login/github/authorized?code=fake")
+            location = response.headers.get("Location", "")
+        except Exception:
+            location = ""
+        elapsed = time.perf_counter() - start
+        with lock:
+            durations.append(elapsed)
+            if location.endswith("/login/loggedin"):
+                outcomes["loggedin"] += 1
+            else:
+                outcomes["failed"] += 1
+
+    connections = provider.connections
+    threads = [threading.Thread(target=login) for _ in range(logins)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    durations.sort()
+    return dict(outcomes,
+                provider_delay_s=provider.delay,
+                occupancy_p50_ms=round(durations[len(durations) // 2] * 1000,
+                                       1),
+                occupancy_max_ms=round(durations[-1] * 1000, 1),
+                new_connections=provider.connections - connections)
+
+
+def main(logins=20, slow_delay=10.0):
+    path = tempfile.mktemp(suffix=".db")
+    os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + path
+    # The stand-in provider speaks plain HTTP
+    os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+    import app
+    provider = FakeProvider().start()
+    app.OAUTH_PROVIDERS["github"].update(
+        base_url=provider.url,
+        access_token_url=provider.url + "login/oauth/access_token")
+    try:
+        results = {
+            "read_timeout_s": app.app.config["OAUTH_READ_TIMEOUT"],
+            "fast_provider": run(app, provider, logins),
+        }
+        provider.delay = slow_delay
+        results["slow_provider"] = run(app, provider, logins)
+        print(json.dumps(results, indent=2))
+    finally:
+        provider.shutdown()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*[float(a) if i else int(a)
+           for i, a in enumerate(sys.argv[1:3])])
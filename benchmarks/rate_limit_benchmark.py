@@ -0,0 +1,73 @@
+"""Cost of admission control per request
+
+Times Limiter.check() with the in-process and the SQLite store, from one
+thread and from several at once, over a set of clients, and a
+ConcurrencyLimit acquire/release pair, and reports microseconds per call:
+    python -m benchmarks.rate_limit_benchmark [calls] [threads] [clients]
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from database_setup import create_db_engine
+from rate_limit import ConcurrencyLimit, Limiter, MemoryLimiterStore
+from rate_limit import SQLiteLimiterStore
+from benchmarks.wal_benchmark import PRAGMAS
+
+# High enough that no call is refused, so every call updates its bucket
+LIMITS = {"api": (10.0 ** 6, 10 ** 6)}
+
+
+def time_calls(call, calls, threads):
+    """Microseconds per call with ``threads`` threads making ``calls``
+    calls in total"""
+    def worker(number):
+        for i in range(calls // threads):
+            call(number, i)
+
+    workers = [threading.Thread(target=worker, args=(n,))
+               for n in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return round((time.perf_counter() - start) / calls * 10 ** 6, 2)
+
+
+def main(calls=100000, threads=8, clients=1000):
+    path = tempfile.mktemp(suffix=".db")
+    try:
+        engine = create_db_engine("sqlite:///" + path, pragmas=PRAGMAS)
+        stores = {"memory": MemoryLimiterStore(),
+                  "sqlite": SQLiteLimiterStore(engine)}
+        results = {"calls": calls, "threads": threads, "clients": clients}
+        for name, store in stores.items():
+            limiter = Limiter(store, LIMITS)
+            count = calls if name == "memory" else calls // 10
+
+            def check(number, i):
+                limiter.check("api", "ip:10.0.%d" % ((number + i) % clients))
+            results[name + "_us"] = {
+                "1_thread": time_calls(check, count, 1),
+                "%d_threads" % threads: time_calls(check, count, threads)}
+        slots = ConcurrencyLimit(64)
+
+        def acquire(number, i):
+            slots.acquire()
+            slots.release()
+        results["concurrency_limit_us"] = {
+            "1_thread": time_calls(acquire, calls, 1),
+            "%d_threads" % threads: time_calls(acquire, calls, threads)}
+        engine.dispose()
+        print(json.dumps(results, indent=2))
+    finally:
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:4]])
@@ -0,0 +1,85 @@
+"""Where the time of the feed and category pages goes
+
+Builds a synthetic catalog in a temporary database, requests the feed and
+a category page as a logged in user (anonymous pages would come from the
+page cache) with the template profiler on and debug mode off, and reports
+per page the mean request time, the SQL time of the view and of the
+templates (lazy loads while rendering) and the time spent rendering each
+template and block:
+    python -m benchmarks.render_profile [requests] [items]
+"""
+import json
+import os
+import sys
+import tempfile
+from database_setup import Item, create_db_engine
+from benchmarks.generate import generate
+from benchmarks.load import login_session
+
+PAGES = {"index": "/feed", "showCategory": "/category/{category_id}"}
+PAGE_TEMPLATES = {"index": "feed.html", "showCategory": "category.html"}
+
+
+def totals(snapshot, name):
+    """{labels: (count, sum)} of a histogram in a metrics snapshot"""
+    return dict((tuple(labels), (sum(value[:-1]), value[-1]))
+                for labels, value in snapshot.get(name, []))
+
+
+def mean_ms(count, seconds):
+    return round(seconds / count * 1000, 3) if count else 0
+
+
+def main(requests=200, items=100000):
+    path = tempfile.mktemp(suffix=".db")
+    url = "sqlite:///" + path
+    try:
+        engine = create_db_engine(url)
+        generate(engine, users=10, categories=100, items=items)
+        with engine.connect() as conn:
+            user_id, category_id = conn.execute(Item.__table__.select(
+                ).with_only_columns(Item.user_id, Item.category_id
+                                    ).limit(1)).first()
+        engine.dispose()
+        os.environ.update(CATALOG_DATABASE_URL=url,
+                          CATALOG_TEMPLATE_PROFILE="1", CATALOG_DEBUG="0",
+                          CATALOG_SESSION_BACKEND="memory")
+        import app
+        client = app.app.test_client()
+        with client.session_transaction() as session:
+            session.update(login_session(user_id))
+        for endpoint, page in PAGES.items():
+            page = page.format(category_id=category_id)
+            for _ in range(requests):
+                assert client.get(page).status_code == 200
+        snapshot = app.metrics.snapshot()
+        durations = totals(snapshot, "catalog_http_request_duration_seconds")
+        sql = totals(snapshot, "catalog_sql_statement_duration_seconds")
+        renders = totals(snapshot, "catalog_template_render_seconds")
+        render_sql = totals(snapshot, "catalog_template_sql_seconds")
+        blocks = totals(snapshot, "catalog_template_block_render_seconds")
+        results = {"requests": requests, "items": items}
+        for endpoint in PAGES:
+            count, seconds = durations[(endpoint,)]
+            template = PAGE_TEMPLATES[endpoint]
+            render_count, render_seconds = renders[(template,)]
+            results[endpoint] = {
+                "request_ms": mean_ms(count, seconds),
+                "sql_ms": mean_ms(count, sql[(endpoint,)][1]),
+                "render_ms": mean_ms(render_count, render_seconds),
+                "render_sql_ms": mean_ms(render_count,
+                                         render_sql[(template,)][1]),
+                "blocks_ms": dict(
+                    ("%s:%s" % labels, mean_ms(render_count, total))
+                    for labels, (n, total) in sorted(blocks.items())
+                    if labels[0] in (template, "base.html")),
+            }
+        print(json.dumps(results, indent=2))
+    finally:
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,53 @@
+"""Compare FTS5 search with a ``LIKE '%term%'`` scan
+
+Builds a synthetic catalog in a temporary database and times both
+queries for a handful of terms:
+    python -m benchmarks.search_benchmark [items] [repeat]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from sqlalchemy import text
+from database_setup import create_db_engine
+from search import build_match
+from benchmarks.generate import generate
+
+TERMS = ["bakuri", "motase", "lupena nisaro", "zzz"]
+
+
+def timed(conn, statement, params, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(text(statement), params).fetchall()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main(items=1000000, repeat=5):
+    path = tempfile.mktemp(suffix=".db")
+    engine = create_db_engine("sqlite:///" + path)
+    try:
+        generate(engine, users=1, categories=1, items=items)
+        results = {"items": items, "terms": {}}
+        with engine.connect() as conn:
+            for term in TERMS:
+                fts = timed(conn,
+                            "SELECT rowid FROM item_search "
+                            "WHERE item_search MATCH :match "
+                            "ORDER BY bm25(item_search) LIMIT 50",
+                            {"match": build_match(term)}, repeat)
+                like = timed(conn,
+                             "SELECT id FROM item WHERE name LIKE :like "
+                             "OR description LIKE :like LIMIT 50",
+                             {"like": "%" + term + "%"}, repeat)
+                results["terms"][term] = {"fts_ms": round(fts, 3),
+                                          "like_ms": round(like, 3)}
+        print(json.dumps(results, indent=2))
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,63 @@
+"""Compare serializing items from ORM objects and from Core rows
+
+Builds a synthetic catalog in a temporary database, then loads and
+JSON-encodes every item both ways and reports rows per second. Both paths
+have to produce the same bytes:
+    python -m benchmarks.serialize_benchmark [items] [repeat]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from flask import Flask
+from sqlalchemy.orm import Session
+from database_setup import Item, create_db_engine
+from serializers import select_items, serialize_item
+from benchmarks.generate import generate
+
+
+def orm_path(engine):
+    with Session(engine) as session:
+        return [i.serialize for i in session.query(Item).order_by(Item.id)]
+
+
+def core_path(engine):
+    with engine.connect() as conn:
+        return [serialize_item(row) for row in
+                conn.execute(select_items().order_by(Item.id))]
+
+
+def timed(path, engine, dumps, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = dumps(path(engine))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, data
+
+
+def main(items=100000, repeat=3):
+    path = tempfile.mktemp(suffix=".db")
+    engine = create_db_engine("sqlite:///" + path)
+    app = Flask(__name__)
+    try:
+        generate(engine, users=10, categories=10, items=items)
+        with app.app_context():
+            # The same encoder jsonify uses
+            dumps = app.json.dumps
+            orm, orm_data = timed(orm_path, engine, dumps, repeat)
+            core, core_data = timed(core_path, engine, dumps, repeat)
+        print(json.dumps({"items": items,
+                          "orm_rows_per_sec": round(items / orm),
+                          "core_rows_per_sec": round(items / core),
+                          "speedup": round(orm / core, 2),
+                          "identical": orm_data == core_data}, indent=2))
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,54 @@
+"""Measure import-to-first-request latency of the app
+
+Every run starts a fresh interpreter (like a gunicorn worker boot) and
+reports how long ``import app`` and the first request to ``/`` take:
+    python -m benchmarks.startup_benchmark [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get("/")
+done = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000,
+                  "first_request_ms": (done - imported) * 1000,
+                  "total_ms": (done - start) * 1000}))
+"""
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def main(runs=10):
+    path = tempfile.mktemp(suffix=".db")
+    env = dict(os.environ, CATALOG_DATABASE_URL="sqlite:///" + path)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples = []
+    try:
+        for _ in range(runs):
+            out = subprocess.check_output([sys.executable, "-c", PROBE],
+                                          cwd=root, env=env)
+            samples.append(json.loads(out.decode().strip().splitlines()[-1]))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    results = {"runs": runs}
+    for key in ("import_ms", "first_request_ms", "total_ms"):
+        values = [s[key] for s in samples]
+        results[key] = {"p50": round(percentile(values, 50), 2),
+                        "p95": round(percentile(values, 95), 2),
+                        "min": round(min(values), 2)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,127 @@
+"""Concurrent reads and writes with one engine versus reader/writer engines
+
+Builds a synthetic catalog in a temporary database, then runs reader
+threads (a category page: category, item page) next to writer threads
+(rename an item and touch its category, like editItem) for a while, once
+with a single engine in rollback-journal mode and once with the app's
+WAL reader/writer engines, and reports throughput, latency percentiles
+and errors such as "database is locked" for both:
+    python -m benchmarks.wal_benchmark [items] [readers] [writers] [seconds]
+"""
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy.orm import sessionmaker
+from database_setup import Category, Item, RoutingSession
+from database_setup import create_db_engine, create_db_engines
+from config import DEFAULTS
+from benchmarks.generate import generate
+from benchmarks.load import percentile
+
+PRAGMAS = {'journal_mode': DEFAULTS['SQLITE_JOURNAL_MODE'],
+           'synchronous': DEFAULTS['SQLITE_SYNCHRONOUS'],
+           'busy_timeout': DEFAULTS['SQLITE_BUSY_TIMEOUT'],
+           'mmap_size': DEFAULTS['SQLITE_MMAP_SIZE'],
+           'cache_size': DEFAULTS['SQLITE_CACHE_SIZE']}
+
+
+def single_engine(url):
+    engine = create_db_engine(url, pragmas={'journal_mode': 'DELETE'})
+    return sessionmaker(bind=engine), [engine]
+
+
+def split_engines(url):
+    reader, writer = create_db_engines(url, pragmas=PRAGMAS)
+    return (sessionmaker(class_=RoutingSession, reader=reader,
+                         writer=writer), [reader, writer])
+
+
+def read(session, item_id, category_id):
+    session.query(Category).filter_by(id=category_id).one()
+    session.query(Item).filter(Item.category_id == category_id,
+                               Item.id > 0).order_by(Item.id).limit(51).all()
+
+
+def write(session, item_id, category_id):
+    item = session.query(Item).filter_by(id=item_id).one()
+    item.name = "Bench %d" % random.randint(0, 10 ** 6)
+    session.query(Category).filter_by(id=category_id).update(
+        {Category.updated: datetime.datetime.utcnow()},
+        synchronize_session=False)
+    session.commit()
+
+
+def run(Session, items, readers, writers, duration):
+    stats = {"read": ([], [0]), "write": ([], [0])}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(kind, number):
+        rnd = random.Random(number)
+        action = read if kind == "read" else write
+        latencies = []
+        errors = 0
+        while time.perf_counter() < deadline:
+            session = Session()
+            start = time.perf_counter()
+            try:
+                action(session, *rnd.choice(items))
+            except Exception:
+                errors += 1
+            finally:
+                session.close()
+            latencies.append(time.perf_counter() - start)
+        with lock:
+            stats[kind][0].extend(latencies)
+            stats[kind][1][0] += errors
+
+    threads = [threading.Thread(target=worker, args=("read", n))
+               for n in range(readers)]
+    threads += [threading.Thread(target=worker, args=("write", 1000 + n))
+                for n in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = {}
+    for kind, (latencies, errors) in stats.items():
+        result[kind] = {"ops_per_sec": round(len(latencies) / duration, 1),
+                        "errors": errors[0],
+                        "p50_ms": percentile(latencies, 50),
+                        "p95_ms": percentile(latencies, 95),
+                        "p99_ms": percentile(latencies, 99)}
+    return result
+
+
+def main(items=100000, readers=8, writers=2, duration=10):
+    path = tempfile.mktemp(suffix=".db")
+    url = "sqlite:///" + path
+    try:
+        engine = create_db_engine(url)
+        generate(engine, users=10, categories=100, items=items)
+        with engine.connect() as conn:
+            sample = [tuple(r) for r in conn.execute(
+                Item.__table__.select().with_only_columns(
+                    Item.id, Item.category_id).limit(10000))]
+        engine.dispose()
+        results = {"items": items, "readers": readers, "writers": writers}
+        for name, setup in (("single_engine", single_engine),
+                            ("wal_reader_writer", split_engines)):
+            Session, engines = setup(url)
+            results[name] = run(Session, sample, readers, writers, duration)
+            for engine in engines:
+                engine.dispose()
+        print(json.dumps(results, indent=2))
+    finally:
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:5]])
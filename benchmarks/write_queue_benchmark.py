@@ -0,0 +1,135 @@
+"""Write throughput with and without the group-commit write queue
+
+Runs writer threads that each create items like newItem (insert the item,
+touch its category, commit) for a while, once committing every write on
+its own and once through a WriteQueue, with SQLite syncing WAL commits
+(synchronous=FULL) and without (NORMAL, the app's default), and reports
+writes per second, latencies and the average batch size:
+    python -m benchmarks.write_queue_benchmark [writers] [seconds] \\
+        [batch-delay-ms]
+"""
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy.orm import sessionmaker
+from database_setup import Base, Category, Item, User, create_db_engines
+from config import DEFAULTS
+from write_queue import WriteQueue
+from benchmarks.load import percentile
+from benchmarks.wal_benchmark import PRAGMAS
+
+CATEGORIES = 100
+
+
+def create_item(session, category_id):
+    item = Item(name="Bench %d" % random.randint(0, 10 ** 6),
+                description="", user_id=1, category_id=category_id)
+    session.add(item)
+    session.query(Category).filter_by(id=category_id).update(
+        {Category.updated: datetime.datetime.utcnow()},
+        synchronize_session=False)
+    session.flush()
+    return item.id
+
+
+def run(write, writers, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(number):
+        rnd = random.Random(number)
+        mine = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                write(rnd.randint(1, CATEGORIES))
+            except Exception:
+                failed += 1
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {"writes_per_sec": round(len(latencies) / duration, 1),
+            "errors": errors[0],
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": round(max(latencies) * 1000, 3)}
+
+
+def direct(Session):
+    def write(category_id):
+        session = Session()
+        try:
+            create_item(session, category_id)
+            session.commit()
+        finally:
+            session.close()
+    return write, None
+
+
+def queued(Session, delay):
+    queue = WriteQueue(Session, DEFAULTS['WRITE_BATCH_SIZE'], delay)
+
+    def write(category_id):
+        queue.run(lambda session: create_item(session, category_id))
+    return write, queue
+
+
+def main(writers=16, duration=5, delay_ms=DEFAULTS['WRITE_BATCH_DELAY'] *
+         1000):
+    results = {"writers": writers, "batch_delay_ms": delay_ms}
+    for synchronous in ("FULL", "NORMAL"):
+        path = tempfile.mktemp(suffix=".db")
+        url = "sqlite:///" + path
+        pragmas = dict(PRAGMAS, synchronous=synchronous)
+        try:
+            reader, writer = create_db_engines(url, pragmas=pragmas)
+            Base.metadata.create_all(writer)
+            Session = sessionmaker(bind=writer)
+            session = Session()
+            session.add(User(id=1, name="bench", email="bench", picture=""))
+            session.add_all(Category(id=n, name="Category %d" % n,
+                                     description="")
+                            for n in range(1, CATEGORIES + 1))
+            session.commit()
+            session.close()
+            results[synchronous] = {}
+            for name in ("direct", "queued"):
+                if name == "direct":
+                    write, queue = direct(Session)
+                else:
+                    write, queue = queued(Session, delay_ms / 1000.0)
+                result = run(write, writers, duration)
+                if queue is not None:
+                    queue.close()
+                    result["avg_batch"] = round(
+                        queue.jobs / float(queue.batches or 1), 1)
+                results[synchronous][name] = result
+            reader.dispose()
+            writer.dispose()
+        finally:
+            for suffix in ("", "-wal", "-shm", "-journal"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:4]
+    main(*[int(a) for a in args[:2]] + [float(a) for a in args[2:]])
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Export and import the whole catalog as NDJSON
+
+Every line is one row of the user, category or item table, tagged with
+its table: ``{"table": "item", "id": 1, "name": ..., ...}``. Rows keep
+their ids, parents come before the rows that refer to them, and dates
+are ISO 8601.
+
+    python catalog_io.py export [--database URL] [--output catalog.ndjson]
+    python catalog_io.py import catalog.ndjson [--database URL] [--resume]
+
+The export streams rows, so memory stays flat however large the catalog
+is. The import writes batches with executemany() and commits every
+``--commit-every`` rows, with synchronous writes off and without the item
+indexes, search and item count triggers, which are rebuilt once at the
+end. After every commit it records the line it got to in a checkpoint
+file; ``--resume`` continues from there after a crash. Rows whose id
+already exists are skipped, so resuming is safe even if the checkpoint
+lags behind the last commit.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from sqlalchemy import DateTime, insert, select
+from database_setup import User, Category, Item, create_db_engine
+from migrations import upgrade
+from search import drop_search_triggers, rebuild_search_index
+from item_counts import drop_item_count_triggers, reconcile_item_counts
+from config import DEFAULTS, from_env
+
+# In the order they have to be imported
+TABLES = [User.__table__, Category.__table__, Item.__table__]
+# Derived from other rows, recomputed after an import
+SKIPPED_COLUMNS = {"item_count"}
+
+BATCH_SIZE = 10000
+COMMIT_EVERY = 200000
+# For the import connection only; a crash can lose the last commits,
+# which --resume then writes again
+LOAD_PRAGMAS = {"synchronous": "OFF", "cache_size": -262144,
+                "temp_store": "MEMORY"}
+
+
+def json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError("Can't serialize %r" % (value,))
+
+
+def export(engine, out, batch_size=BATCH_SIZE):
+    """Write every row as NDJSON to ``out`` and return the row counts"""
+    counts = {}
+    with engine.connect() as conn:
+        for table in TABLES:
+            columns = [c for c in table.columns
+                       if c.name not in SKIPPED_COLUMNS]
+            rows = conn.execution_options(yield_per=batch_size).execute(
+                select(*columns).order_by(table.c.id))
+            count = 0
+            for row in rows:
+                record = {"table": table.name}
+                record.update(zip(row._fields, row))
+                out.write(json.dumps(record, default=json_default) + "\n")
+                count += 1
+            counts[table.name] = count
+    return counts
+
+
+class Importer(object):
+    """Insert NDJSON rows in batches, see the module docstring"""
+
+    def __init__(self, engine, checkpoint=None, batch_size=BATCH_SIZE,
+                 commit_every=COMMIT_EVERY, log=sys.stderr):
+        self.engine = engine
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.log = log
+        self.tables = dict((t.name, t) for t in TABLES)
+        self.dates = dict((t.name, [c.name for c in t.columns
+                                    if isinstance(c.type, DateTime)])
+                          for t in TABLES)
+        self.counts = dict((t.name, 0) for t in TABLES)
+        self.skipped = 0
+
+    def read_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint) as f:
+            return json.load(f)["line"]
+
+    def write_checkpoint(self, line):
+        if not self.checkpoint:
+            return
+        with open(self.checkpoint + ".tmp", "w") as f:
+            json.dump({"line": line}, f)
+        os.replace(self.checkpoint + ".tmp", self.checkpoint)
+
+    def parse(self, line):
+        record = json.loads(line)
+        table = record.pop("table")
+        for name in self.dates[table]:
+            if record.get(name):
+                record[name] = datetime.datetime.fromisoformat(record[name])
+        for name in SKIPPED_COLUMNS:
+            record.pop(name, None)
+        return table, record
+
+    def insert(self, conn, table, rows):
+        if not rows:
+            return
+        statement = insert(self.tables[table])
+        if conn.dialect.name == "sqlite":
+            statement = statement.prefix_with("OR IGNORE")
+        inserted = conn.execute(statement, rows).rowcount
+        self.counts[table] += inserted
+        self.skipped += len(rows) - inserted
+
+    def prepare(self, conn):
+        """Drop what would otherwise be updated row by row"""
+        drop_search_triggers(conn)
+        drop_item_count_triggers(conn)
+        for index in Item.__table__.indexes:
+            index.drop(conn, checkfirst=True)
+
+    def finish(self, conn):
+        for index in Item.__table__.indexes:
+            index.create(conn, checkfirst=True)
+        reconcile_item_counts(conn)
+
+    def run(self, lines, start=0):
+        """Import ``lines`` (an iterable of NDJSON strings), skipping the
+        first ``start``; returns the number of lines read"""
+        started = time.perf_counter()
+        upgrade(self.engine)
+        number = 0
+        try:
+            with self.engine.begin() as conn:
+                self.prepare(conn)
+            # Leaving the block on an error rolls back the open batch
+            with self.engine.connect() as conn:
+                transaction = conn.begin()
+                table, batch, pending = None, [], 0
+                for number, line in enumerate(lines, 1):
+                    if number <= start or not line.strip():
+                        continue
+                    name, row = self.parse(line)
+                    if name != table or len(batch) >= self.batch_size:
+                        self.insert(conn, table, batch)
+                        table, batch = name, []
+                    batch.append(row)
+                    pending += 1
+                    if pending >= self.commit_every:
+                        self.insert(conn, table, batch)
+                        batch, pending = [], 0
+                        transaction.commit()
+                        self.write_checkpoint(number)
+                        self.report(started, number)
+                        transaction = conn.begin()
+                self.insert(conn, table, batch)
+                transaction.commit()
+                self.write_checkpoint(number)
+        finally:
+            # Also after a failure, so the app keeps working on what was
+            # imported so far
+            with self.engine.begin() as conn:
+                self.finish(conn)
+            rebuild_search_index(self.engine)
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        return number
+
+    def report(self, started, line):
+        rows = sum(self.counts.values())
+        seconds = time.perf_counter() - started
+        self.log.write("line %d: %d rows in %.1fs (%d rows/s)\n" % (
+            line, rows, seconds, rows / seconds if seconds else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("file", nargs="?", default="-",
+                        help="NDJSON file to import ('-' for stdin)")
+    parser.add_argument("--database",
+                        default=from_env("DATABASE_URL",
+                                         DEFAULTS["DATABASE_URL"]))
+    parser.add_argument("--output", default="-",
+                        help="file to export to ('-' for stdout)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted import")
+    parser.add_argument("--commit-every", type=int, default=COMMIT_EVERY)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == "export":
+        engine = create_db_engine(args.database)
+        if args.output == "-":
+            counts = export(engine, sys.stdout)
+        else:
+            with open(args.output, "w") as out:
+                counts = export(engine, out)
+        skipped = 0
+    else:
+        engine = create_db_engine(args.database, pragmas=LOAD_PRAGMAS)
+        checkpoint = None
+        if args.file != "-":
+            checkpoint = args.file + ".checkpoint"
+        importer = Importer(engine, checkpoint,
+                            commit_every=args.commit_every)
+        start = importer.read_checkpoint() if args.resume else 0
+        if args.file == "-":
+            importer.run(sys.stdin, start)
+        else:
+            with open(args.file) as lines:
+                importer.run(lines, start)
+        counts, skipped = importer.counts, importer.skipped
+    seconds = time.perf_counter() - started
+    rows = sum(counts.values())
+    sys.stderr.write(json.dumps({
+        "command": args.command, "rows": counts, "skipped": skipped,
+        "seconds": round(seconds, 2),
+        "rows_per_sec": round(rows / seconds) if seconds else None}) + "\n")
+
+
+if __name__ == '__main__':
+    main()
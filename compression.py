@@ -0,0 +1,89 @@
+"""Compress responses with gzip, or brotli if the module is installed
+
+Responses keep their strong ETag with the encoding appended, since the
+compressed bytes differ from the plain ones; isNotModified() accepts every
+encoded variant of an ETag, so clients still get their 304s.
+"""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Most preferred first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+COMPRESSIBLE_MIMETYPES = (
+    "text/html", "text/css", "text/plain", "text/javascript",
+    "application/javascript", "application/json", "application/x-ndjson",
+    "image/svg+xml",
+)
+
+
+def negotiate(accept_encodings, available=ENCODINGS):
+    """Return the best of ``available`` the client accepts, or None"""
+    for encoding in available:
+        if accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def etag_variants(etag):
+    return [etag] + ["%s-%s" % (etag, encoding) for encoding in ENCODINGS]
+
+
+def compress(data, encoding, level=6):
+    if encoding == "br":
+        # brotli's 0-11 quality, scaled from the 1-9 gzip level
+        return brotli.compress(data, quality=min(11, level + 2))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks, encoding, level=6):
+    """Compress an iterable of chunks as it is consumed"""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=min(11, level + 2))
+        add, finish = compressor.process, compressor.finish
+    else:
+        # wbits above 16 writes a gzip header and trailer
+        compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        add, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = add(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response, accept_encodings, min_size=1024, level=6):
+    """Compress ``response`` in place if it is worth it and the client
+    accepts one of ENCODINGS"""
+    # Files from send_file() are left alone, static assets are
+    # precompressed by ``python assets.py build`` instead
+    if (response.status_code != 200 or response.direct_passthrough or
+            "Content-Encoding" in response.headers or
+            response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    encoding = negotiate(accept_encodings)
+    response.vary.add("Accept-Encoding")
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding,
+                                            level)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(compress(data, encoding, level))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag("%s-%s" % (etag, encoding), weak)
+    return response
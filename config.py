@@ -0,0 +1,101 @@
+"""Application configuration
+
+Every setting can be overridden with a ``CATALOG_<NAME>`` environment
+variable. OAuth credentials otherwise come from the provider's secrets
+file, which is read at most once and only if a value is still missing.
+"""
+import json
+import os
+
+DEFAULTS = {
+    'SECRET_KEY': "UaGGGuWqikQaMIZ1JCn6vJXHIK003YBKlqk8sdzn",
+    'DATABASE_URL': 'sqlite:///itemcatalog.db',
+    'DB_POOL_SIZE': 10,
+    'DB_MAX_OVERFLOW': 20,
+    'DB_POOL_TIMEOUT': 30,
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_CACHE_SIZE': -16000,
+    'PAGE_CACHE_SIZE': 16 * 1024 * 1024,
+    'OAUTH_CONNECT_TIMEOUT': 3.05,
+    'OAUTH_READ_TIMEOUT': 5.0,
+    'OAUTH_POOL_SIZE': 10,
+    'USER_CACHE_SIZE': 10000,
+    'BACKGROUND_DELETE_THRESHOLD': 50000,
+    'DELETE_BATCH_SIZE': 5000,
+    'BULK_MAX_ITEMS': 1000,
+    'COMPRESS_MIN_SIZE': 1024,
+    'COMPRESS_LEVEL': 6,
+    'METRICS_DIR': '',
+    'METRICS_FLUSH_INTERVAL': 1.0,
+    'FEED_STREAM_HEARTBEAT': 15.0,
+    'FEED_STREAM_QUEUE': 1000,
+    'SESSION_BACKEND': 'sqlite',
+    'SESSION_DATABASE_URL': 'sqlite:///sessions.db',
+    'SESSION_TTL': 31 * 24 * 60 * 60,
+    'SESSION_CACHE_SIZE': 10000,
+    'WRITE_QUEUE': False,
+    'WRITE_BATCH_SIZE': 64,
+    'WRITE_BATCH_DELAY': 0.005,
+    'RATE_LIMIT_STORE': '',
+    'RATE_LIMIT_DATABASE_URL': 'sqlite:///ratelimit.db',
+    'RATE_LIMIT_CLIENTS': 100000,
+    'TRUSTED_PROXIES': 0,
+    'RATE_LIMIT_API_RATE': 10.0,
+    'RATE_LIMIT_API_BURST': 50,
+    'RATE_LIMIT_HTML_RATE': 5.0,
+    'RATE_LIMIT_HTML_BURST': 30,
+    'RATE_LIMIT_WRITE_RATE': 1.0,
+    'RATE_LIMIT_WRITE_BURST': 10,
+    'MAX_CONCURRENT_REQUESTS': 0,
+    'MAX_CONCURRENT_WRITES': 0,
+    'DEBUG': True,
+    'TEMPLATE_CACHE_DIR': 'template_bytecode',
+    'TEMPLATE_PROFILE': False,
+}
+
+# config key: (secrets file, path to the value inside it)
+SECRETS = {
+    'GOOGLE_ID': ('client_secrets.json', ('web', 'client_id')),
+    'GOOGLE_SECRET': ('client_secrets.json', ('web', 'client_secret')),
+    'GITHUB_ID': ('gh_client_secrets.json', ('client_id',)),
+    'GITHUB_SECRET': ('gh_client_secrets.json', ('client_secret',)),
+    'FACEBOOK_ID': ('fb_client_secrets.json', ('web', 'app_id')),
+    'FACEBOOK_SECRET': ('fb_client_secrets.json', ('web', 'app_secret')),
+}
+
+
+def from_env(name, default):
+    value = os.environ.get('CATALOG_' + name)
+    if value is None:
+        return default
+    if isinstance(default, float):
+        return float(value)
+    if isinstance(default, int):
+        return int(value)
+    return value
+
+
+def load_config(config):
+    """Fill a Flask ``config`` from the defaults, env vars and secrets"""
+    for name, default in DEFAULTS.items():
+        config[name] = from_env(name, default)
+
+    files = {}
+    for name, (path, keys) in SECRETS.items():
+        value = from_env(name, None)
+        if value is None:
+            if path not in files:
+                try:
+                    with open(path, 'r') as f:
+                        files[path] = json.load(f)
+                except IOError:
+                    files[path] = {}
+            value = files[path]
+            for key in keys:
+                value = value.get(key, {})
+            value = value or None
+        config[name] = value
+    return config
@@ -1,7 +1,9 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, relationship
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool, StaticPool
 import datetime
 
 Base = declarative_base()
@@ -15,6 +17,10 @@ class User(Base):
     email = Column(String(250), nullable=False)
     picture = Column(String(250))
 
+    __table_args__ = (
+        Index('ix_user_email', 'email', unique=True),
+    )
+
 
 class Category(Base):
     __tablename__ = 'category'
@@ -22,13 +28,20 @@ class Category(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False)
     description = Column(String(250), nullable=False)
+    # Bumped on every change to the category or its items (used for ETags)
+    updated = Column(DateTime, default=datetime.datetime.utcnow,
+                     onupdate=datetime.datetime.utcnow)
+    # Kept up to date by the triggers in item_counts.py
+    item_count = Column(Integer, nullable=False, default=0,
+                        server_default='0')
 
     @property
     def serialize(self):
         return {
             'name': self.name,
             'description': self.description,
-            'id': self.id
+            'id': self.id,
+            'item_count': self.item_count
         }
 
 class Item(Base):
@@ -38,10 +51,19 @@ class Item(Base):
     name = Column(String(250), nullable=False)
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship(User)
-    category_id = Column(Integer, ForeignKey('category.id'))
+    category_id = Column(Integer, ForeignKey('category.id',
+                                             ondelete='CASCADE'))
     category = relationship(Category)
     created = Column(DateTime, default=datetime.datetime.utcnow)
     description = Column(String, nullable=True)
+    updated = Column(DateTime, default=datetime.datetime.utcnow,
+                     onupdate=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # Serves filter_by(category_id=...) ordered by id (category pages)
+        Index('ix_item_category_id_id', 'category_id', 'id'),
+        Index('ix_item_user_id', 'user_id'),
+    )
 
     @property
     def serialize(self):
@@ -55,8 +77,129 @@ class Item(Base):
         }
 
 
-
-engine = create_engine('sqlite:///itemcatalog.db')
-
-
-Base.metadata.create_all(engine)
+MEMORY_URLS = ('sqlite://', 'sqlite:///:memory:')
+
+
+def create_db_engine(url='sqlite:///itemcatalog.db', pool_size=10,
+                     max_overflow=20, pool_timeout=30, pragmas=None,
+                     query_only=False, begin_immediate=False):
+    """Create an engine whose pool can be shared by all worker threads
+
+    For SQLite, ``pragmas`` (e.g. ``{'journal_mode': 'WAL'}``) are set on
+    every new connection, ``query_only`` makes the connections refuse
+    writes and ``begin_immediate`` takes the write lock when a transaction
+    starts instead of at its first write.
+    """
+    options = {}
+    if url.startswith('sqlite'):
+        # Connections move between threads through the pool, so SQLite's
+        # same-thread check has to be disabled.
+        options['connect_args'] = {'check_same_thread': False}
+        if url in MEMORY_URLS:
+            # An in-memory database only exists on its one connection.
+            engine = create_engine(url, poolclass=StaticPool, **options)
+        else:
+            engine = create_engine(url,
+                                   poolclass=QueuePool,
+                                   pool_size=pool_size,
+                                   max_overflow=max_overflow,
+                                   pool_timeout=pool_timeout,
+                                   **options)
+        event.listen(engine, 'connect', SQLitePragmas(
+            pragmas or {}, query_only, begin_immediate))
+        if begin_immediate:
+            event.listen(engine, 'begin', begin_immediately)
+        return engine
+    return create_engine(url,
+                         poolclass=QueuePool,
+                         pool_size=pool_size,
+                         max_overflow=max_overflow,
+                         pool_timeout=pool_timeout,
+                         **options)
+
+
+def create_db_engines(url='sqlite:///itemcatalog.db', pool_size=10,
+                      max_overflow=20, pool_timeout=30, pragmas=None):
+    """Return a ``(reader, writer)`` pair of engines for a RoutingSession
+
+    For a SQLite file the writer has a single connection, so writes from
+    all threads are serialized in the pool instead of failing with
+    "database is locked", while the readers (query only) keep reading
+    alongside it in WAL mode. Other databases use one engine for both.
+    """
+    if not url.startswith('sqlite') or url in MEMORY_URLS:
+        engine = create_db_engine(url, pool_size, max_overflow, pool_timeout,
+                                  pragmas)
+        return engine, engine
+    # The writer goes first, as only it may switch the journal mode
+    writer = create_db_engine(url, 1, 0, pool_timeout, pragmas,
+                              begin_immediate=True)
+    with writer.connect():
+        pass
+    reader = create_db_engine(url, pool_size, max_overflow, pool_timeout,
+                              pragmas, query_only=True)
+    return reader, writer
+
+
+class SQLitePragmas(object):
+    """Connect listener that configures new SQLite connections"""
+
+    def __init__(self, pragmas, query_only=False, begin_immediate=False):
+        self.pragmas = pragmas
+        self.query_only = query_only
+        self.begin_immediate = begin_immediate
+
+    def __call__(self, dbapi_connection, connection_record):
+        if self.begin_immediate:
+            # Leave BEGIN to begin_immediately() instead of the driver
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        # SQLite only enforces foreign keys (and ON DELETE CASCADE) when
+        # asked
+        cursor.execute('PRAGMA foreign_keys=ON')
+        for name, value in self.pragmas.items():
+            if name == 'journal_mode' and self.query_only:
+                continue
+            cursor.execute('PRAGMA %s=%s' % (name, value))
+        if self.query_only:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+
+def begin_immediately(conn):
+    conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+class RoutingSession(Session):
+    """Session that reads through ``reader`` and writes through ``writer``
+
+    Once a transaction has written, the rest of it stays on the writer, so
+    it sees its own changes and reads under the write lock.
+    """
+
+    def __init__(self, reader=None, writer=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.reader = reader
+        self.writer = writer
+        self.writing = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.writer is None:
+            return super(RoutingSession, self).get_bind(mapper, clause,
+                                                        **kwargs)
+        if (self.writing or self._flushing or
+                isinstance(clause, UpdateBase)):
+            self.writing = True
+            return self.writer
+        return self.reader
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def stop_writing(session, transaction):
+    if transaction.parent is None:
+        session.writing = False
+
+
+if __name__ == '__main__':
+    engine = create_db_engine()
+    Base.metadata.create_all(engine)
@@ -0,0 +1,71 @@
+"""Publish/subscribe within one process
+
+Publishing hands the event to every subscriber's queue and never blocks.
+A subscriber that falls ``max_queue`` events behind is closed instead of
+holding up the others; an SSE client simply reconnects and resumes.
+
+Subscribers block in Subscription.get(), so under gunicorn's gevent (or
+eventlet) workers an idle subscriber is a parked greenlet rather than a
+worker thread.
+"""
+from collections import deque
+import threading
+
+CLOSED = object()
+
+
+class Subscription(object):
+
+    def __init__(self, max_queue):
+        self.max_queue = max_queue
+        self.closed = False
+        self._events = deque()
+        self._ready = threading.Condition(threading.Lock())
+
+    def put(self, event):
+        with self._ready:
+            if self.closed:
+                return
+            if len(self._events) >= self.max_queue:
+                self.closed = True
+                event = CLOSED
+            self._events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """Return the next event, None after ``timeout`` seconds without
+        one, or CLOSED once the subscription has been dropped"""
+        with self._ready:
+            if not self._events:
+                self._ready.wait(timeout)
+            if not self._events:
+                return None
+            return self._events.popleft()
+
+
+class EventBus(object):
+
+    def __init__(self, max_queue=1000):
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+        return len(subscribers)
+
+    def __len__(self):
+        return len(self._subscribers)
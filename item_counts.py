@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Number of items per category, stored in ``category.item_count``
+
+Triggers on ``item`` adjust the count of the affected categories in the
+same transaction as every insert, delete (including ON DELETE CASCADE
+and the batched category deletes) and move between categories, so the
+feed and the API read the counts without a COUNT(*) per category.
+
+Repair counts that have drifted (e.g. after writing to the database with
+the triggers dropped) with:
+    python item_counts.py reconcile [database-url]
+"""
+import sys
+from sqlalchemy import text
+from database_setup import create_db_engine
+
+ITEM_COUNT_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS item_count_ai AFTER INSERT ON item
+    WHEN new.category_id IS NOT NULL BEGIN
+        UPDATE category SET item_count = item_count + 1
+        WHERE id = new.category_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS item_count_ad AFTER DELETE ON item
+    WHEN old.category_id IS NOT NULL BEGIN
+        UPDATE category SET item_count = item_count - 1
+        WHERE id = old.category_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS item_count_au
+    AFTER UPDATE OF category_id ON item
+    WHEN old.category_id IS NOT new.category_id BEGIN
+        UPDATE category SET item_count = item_count - 1
+        WHERE id = old.category_id;
+        UPDATE category SET item_count = item_count + 1
+        WHERE id = new.category_id;
+    END""",
+]
+
+
+def has_triggers(bind):
+    return bind.dialect.name == "sqlite"
+
+
+def setup_item_count_triggers(conn):
+    if not has_triggers(conn):
+        return
+    for statement in ITEM_COUNT_DDL:
+        conn.execute(text(statement))
+
+
+def drop_item_count_triggers(conn):
+    """Stop counting item writes, e.g. for a bulk load; call
+    reconcile_item_counts() afterwards to catch up and re-enable them"""
+    for name in ("item_count_ai", "item_count_ad", "item_count_au"):
+        conn.execute(text("DROP TRIGGER IF EXISTS %s" % name))
+
+
+def reconcile_item_counts(conn):
+    """Recount every category from the item table (one pass over the
+    category index) and return how many counts were wrong"""
+    setup_item_count_triggers(conn)
+    return conn.execute(text(
+        "UPDATE category SET item_count = (SELECT COUNT(*) FROM item "
+        "WHERE item.category_id = category.id) "
+        "WHERE item_count IS NOT (SELECT COUNT(*) FROM item "
+        "WHERE item.category_id = category.id)")).rowcount
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != "reconcile":
+        print("Usage: python item_counts.py reconcile [database-url]")
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        engine = create_db_engine(sys.argv[2])
+    else:
+        engine = create_db_engine()
+    with engine.begin() as conn:
+        fixed = reconcile_item_counts(conn)
+    print("Fixed the item count of %d categories" % fixed)
@@ -0,0 +1,150 @@
+"""Counters and histograms in the Prometheus text format
+
+Every process keeps its metrics in memory, which only costs a dict lookup
+and a lock per observation. With a ``directory`` shared by all gunicorn
+workers, each worker also writes a snapshot of its metrics there (at most
+every ``flush_interval`` seconds, from flush()), and render() adds up the
+snapshots of every worker, including ones that have exited, so the
+totals stay monotonic whichever worker answers the scrape.
+"""
+from bisect import bisect_left
+import json
+import os
+import threading
+import time
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5,
+               1.0)
+
+
+def escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def format_labels(names, values, extra=""):
+    pairs = ['%s="%s"' % (n, escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metrics(object):
+    """Registry of counters and histograms, see the module docstring"""
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory or None
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._flushed = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def counter(self, name, help, labels=()):
+        self._metrics[name] = ("counter", help, tuple(labels), None)
+        self._values[name] = {}
+
+    def histogram(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        self._metrics[name] = ("histogram", help, tuple(labels),
+                               tuple(buckets))
+        self._values[name] = {}
+
+    def inc(self, name, labels=(), amount=1):
+        values = self._values[name]
+        with self._lock:
+            values[labels] = values.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Count ``value`` in its bucket; the list holds one count per
+        bucket (the last one is +Inf), then the sum"""
+        buckets = self._metrics[name][3]
+        values = self._values[name]
+        with self._lock:
+            counts = values.get(labels)
+            if counts is None:
+                counts = values[labels] = [0] * (len(buckets) + 2)
+            counts[bisect_left(buckets, value)] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict((name, [[list(labels), value]
+                                for labels, value in values.items()])
+                        for name, values in self._values.items())
+
+    def flush(self, force=False):
+        """Write this worker's snapshot to the shared directory"""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed < self.flush_interval:
+            return
+        self._flushed = now
+        path = os.path.join(self.directory, "%d.json" % os.getpid())
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def collect(self):
+        """Return the metrics of all workers added up"""
+        if not self.directory:
+            return self.snapshot()
+        self.flush(force=True)
+        totals = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = json.load(f)
+            except (IOError, ValueError):
+                continue
+            for metric, rows in snapshot.items():
+                merged = totals.setdefault(metric, {})
+                for labels, value in rows:
+                    labels = tuple(labels)
+                    if labels not in merged:
+                        merged[labels] = value
+                    elif isinstance(value, list):
+                        merged[labels] = [a + b for a, b in
+                                          zip(merged[labels], value)]
+                    else:
+                        merged[labels] += value
+        return dict((metric, list(rows.items()))
+                    for metric, rows in totals.items())
+
+    def render(self):
+        lines = []
+        collected = self.collect()
+        for name, (kind, help, label_names, buckets) in sorted(
+                self._metrics.items()):
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in sorted(collected.get(name, ())):
+                if kind == "counter":
+                    lines.append("%s%s %s" % (
+                        name, format_labels(label_names, labels),
+                        format_value(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ("+Inf",), value[:-1]):
+                    cumulative += count
+                    lines.append("%s_bucket%s %d" % (
+                        name, format_labels(label_names, labels,
+                                            'le="%s"' % bound), cumulative))
+                lines.append("%s_sum%s %s" % (
+                    name, format_labels(label_names, labels),
+                    format_value(value[-1])))
+                lines.append("%s_count%s %d" % (
+                    name, format_labels(label_names, labels), cumulative))
+        return "\n".join(lines) + "\n"
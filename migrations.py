@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Versioned schema migrations for the item catalog
+
+``Base.metadata.create_all`` only creates missing tables, so every later
+schema change (indexes, new columns, ...) is added here as a numbered
+migration. ``upgrade()`` runs on startup and applies the ones an existing
+database has not seen yet, each in its own transaction.
+
+Upgrade a database by hand with:
+    python migrations.py [database-url]
+"""
+import sys
+from sqlalchemy import inspect, text
+from database_setup import Base, Item, create_db_engine
+from search import has_fts, setup_search_index
+from item_counts import reconcile_item_counts
+
+
+def add_indexes(conn):
+    # Users could sign up twice with the same email before the unique
+    # index existed, so merge duplicates into the oldest account first.
+    conn.execute(text(
+        "UPDATE item SET user_id = (SELECT MIN(u2.id) FROM user u1 "
+        "JOIN user u2 ON u1.email = u2.email WHERE u1.id = item.user_id) "
+        "WHERE user_id IN (SELECT id FROM user) AND user_id NOT IN "
+        "(SELECT MIN(id) FROM user GROUP BY email)"))
+    conn.execute(text(
+        "DELETE FROM user WHERE id NOT IN "
+        "(SELECT MIN(id) FROM user GROUP BY email)"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_user_email ON user (email)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_item_category_id_id "
+        "ON item (category_id, id)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_item_user_id ON item (user_id)"))
+
+
+def add_column(conn, table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN unless create_all already added it"""
+    if column in [c["name"] for c in inspect(conn).get_columns(table)]:
+        return False
+    conn.execute(text("ALTER TABLE %s ADD COLUMN %s %s" % (table, column,
+                                                           ddl)))
+    return True
+
+
+def add_updated_columns(conn):
+    if add_column(conn, "category", "updated", "DATETIME"):
+        conn.execute(text("UPDATE category SET updated = CURRENT_TIMESTAMP"))
+    if add_column(conn, "item", "updated", "DATETIME"):
+        conn.execute(text(
+            "UPDATE item SET updated = COALESCE(created, CURRENT_TIMESTAMP)"))
+
+
+def cascade_item_deletes(conn):
+    """Re-create the item table so that deleting a category deletes its
+    items in the database (SQLite can't alter a foreign key in place)"""
+    if conn.dialect.name != "sqlite":
+        return
+    fks = inspect(conn).get_foreign_keys("item")
+    if any(fk["referred_table"] == "category" and
+           (fk.get("options") or {}).get("ondelete") == "CASCADE"
+           for fk in fks):
+        return
+    conn.execute(text("DROP INDEX IF EXISTS ix_item_category_id_id"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_item_user_id"))
+    # The search triggers move along with the renamed table and are
+    # dropped with it below
+    conn.execute(text("ALTER TABLE item RENAME TO item_old"))
+    Item.__table__.create(conn)
+    # Items whose category is gone would violate the new constraint (and
+    # are unreachable anyway); authors that don't exist are unset.
+    conn.execute(text(
+        "INSERT INTO item (id, name, user_id, category_id, created, "
+        "description, updated) "
+        "SELECT id, name, "
+        "CASE WHEN user_id IN (SELECT id FROM user) THEN user_id END, "
+        "category_id, created, description, updated FROM item_old "
+        "WHERE category_id IS NULL OR category_id IN "
+        "(SELECT id FROM category)"))
+    conn.execute(text("DROP TABLE item_old"))
+    setup_search_index(conn)
+    if has_fts(conn):
+        conn.execute(text(
+            "INSERT INTO item_search(item_search) VALUES ('rebuild')"))
+
+
+def add_item_counts(conn):
+    add_column(conn, "category", "item_count", "INTEGER NOT NULL DEFAULT 0")
+    reconcile_item_counts(conn)
+
+
+# (version, description, function) -- append only, never renumber
+MIGRATIONS = [
+    (1, "Add item and user email indexes", add_indexes),
+    (2, "Add full-text search index", setup_search_index),
+    (3, "Add updated timestamps to categories and items",
+     add_updated_columns),
+    (4, "Cascade category deletes to items", cascade_item_deletes),
+    (5, "Count the items of every category", add_item_counts),
+]
+
+
+def get_version(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER)"))
+    version = conn.execute(
+        text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+
+def upgrade(engine):
+    """Bring the database up to the latest schema version
+
+    Migrations are written to be idempotent, so a database created by
+    create_all (which already has the indexes) and several workers
+    starting at once are both safe.
+    """
+    Base.metadata.create_all(engine)
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        with engine.begin() as conn:
+            if get_version(conn) >= version:
+                continue
+            migrate(conn)
+            conn.execute(text(
+                "INSERT INTO schema_version (version) VALUES (:version)"),
+                {"version": version})
+        applied.append((version, description))
+    return applied
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        engine = create_db_engine(sys.argv[1])
+    else:
+        engine = create_db_engine()
+    for version, description in upgrade(engine):
+        print("Applied migration %d: %s" % (version, description))
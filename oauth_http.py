@@ -0,0 +1,47 @@
+"""Pooled HTTP transport for the OAuth clients
+
+flask_oauthlib opens a new urllib connection for every token exchange and
+profile request and waits on it without a timeout, so a slow provider ties
+up the worker for as long as it likes. ``PooledTransport.http_request``
+is a drop-in replacement that keeps connections to the providers alive in
+a pool and gives up after the configured timeouts.
+
+requests cooperates with gevent's monkey patching, so under a gevent
+worker (``gunicorn -k gevent app:app``) a waiting callback doesn't hold an
+OS thread either.
+"""
+import requests
+from requests.adapters import HTTPAdapter
+from flask_oauthlib.client import OAuthException, prepare_request
+
+
+class PooledResponse(object):
+    """The parts of a urllib response flask_oauthlib looks at"""
+
+    def __init__(self, response):
+        self.code = response.status_code
+        self.headers = response.headers
+
+
+class PooledTransport(object):
+
+    def __init__(self, connect_timeout=3.05, read_timeout=5.0,
+                 pool_size=10):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size,
+                              max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def http_request(self, uri, headers=None, data=None, method=None):
+        uri, headers, data, method = prepare_request(uri, headers, data,
+                                                     method)
+        try:
+            response = self.session.request(method, uri, headers=headers,
+                                            data=data, timeout=self.timeout,
+                                            allow_redirects=False)
+        except requests.RequestException as e:
+            raise OAuthException("Request to %s failed: %s" % (uri, e),
+                                 type="network_error")
+        return PooledResponse(response), response.content
@@ -0,0 +1,142 @@
+"""Per-client rate limits and caps on the requests in flight
+
+Limiter gives every client (user or IP address) a token bucket per budget
+(e.g. API reads, pages, writes): ``rate`` requests per second on average
+and bursts of up to ``burst`` requests. The bucket is kept as the time it
+would be full again (GCRA, equivalent to a token bucket), a single number
+per client, so checking a request is one atomic update:
+MemoryLimiterStore keeps them in a dict of this process,
+SQLiteLimiterStore in a table shared by every worker that uses the same
+database file (one UPSERT ... RETURNING, SQLite 3.35 or later).
+
+ConcurrencyLimit counts the requests a process is serving and refuses new
+ones beyond its maximum, so overload is answered right away instead of
+queueing up behind the busy workers.
+"""
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table
+from sqlalchemy import delete
+
+metadata = MetaData()
+rate_limit_table = Table(
+    "rate_limit", metadata,
+    Column("key", String(128), primary_key=True),
+    Column("tat", Float, nullable=False, index=True),
+    Column("allowed", Integer, nullable=False),
+)
+
+
+class MemoryLimiterStore(object):
+    """Buckets of this process; beyond ``maxsize`` clients the least
+    recently seen are forgotten (which refills their bucket)"""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Take a token from ``key``'s bucket; returns 0 or the seconds
+        until the next one is available"""
+        interval = 1.0 / rate
+        with self._lock:
+            tat = max(self._tats.get(key, now), now) + interval
+            wait = tat - now - burst * interval
+            if wait > 0:
+                return wait
+            self._tats[key] = tat
+            self._tats.move_to_end(key)
+            if len(self._tats) > self.maxsize:
+                self._tats.popitem(last=False)
+        return 0
+
+
+class SQLiteLimiterStore(object):
+    """Buckets in a SQLite table, shared by every worker using the same
+    database; full buckets are removed every ``cleanup_interval`` takes"""
+
+    TAKE = (
+        "INSERT INTO rate_limit (key, tat, allowed) "
+        "VALUES (:key, :now + :interval, 1) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        "tat = CASE WHEN max(tat, :now) + :interval - :now <= :window "
+        "THEN max(tat, :now) + :interval ELSE tat END, "
+        "allowed = max(tat, :now) + :interval - :now <= :window "
+        "RETURNING tat, allowed")
+
+    def __init__(self, engine, cleanup_interval=10000):
+        self.engine = engine
+        self.cleanup_interval = cleanup_interval
+        self._takes = 0
+        self._lock = threading.Lock()
+        metadata.create_all(engine)
+
+    def take(self, key, rate, burst, now):
+        interval = 1.0 / rate
+        window = burst * interval
+        if self._should_clean_up():
+            with self.engine.begin() as conn:
+                conn.execute(delete(rate_limit_table).where(
+                    rate_limit_table.c.tat < now))
+        # The DB-API connection directly, a third of the time of going
+        # through a SQLAlchemy Connection for this one statement
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.TAKE, {"key": key, "now": now,
+                                       "interval": interval,
+                                       "window": window})
+            tat, allowed = cursor.fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+        if allowed:
+            return 0
+        return tat + interval - now - window
+
+    def _should_clean_up(self):
+        with self._lock:
+            self._takes += 1
+            return self._takes % self.cleanup_interval == 0
+
+
+class Limiter(object):
+    """Rate limits per budget: ``limits`` maps a budget name to a
+    ``(rate, burst)`` pair, a rate of 0 leaves the budget unlimited"""
+
+    def __init__(self, store, limits, clock=None):
+        self.store = store
+        self.limits = limits
+        self.clock = clock or time.time
+
+    def check(self, budget, client):
+        """Count a request of ``client`` against ``budget``; returns 0 if
+        it may go ahead, otherwise the seconds it should wait"""
+        rate, burst = self.limits[budget]
+        if not rate:
+            return 0
+        return self.store.take(budget + ":" + client, rate, max(burst, 1),
+                               self.clock())
+
+
+class ConcurrencyLimit(object):
+    """At most ``maximum`` holders at a time (0 means no limit)"""
+
+    def __init__(self, maximum=0):
+        self.maximum = maximum
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot without waiting; False if all are taken"""
+        with self._lock:
+            if self.maximum and self.active >= self.maximum:
+                return False
+            self.active += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
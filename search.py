@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Full-text search over items, backed by an SQLite FTS5 table
+
+The ``item_search`` table indexes ``item.name`` and ``item.description``
+and is kept in sync by triggers on ``item``, so every write path
+(including bulk deletes) updates it in the same transaction.
+
+Rebuild the index of an existing database with:
+    python search.py rebuild [database-url]
+"""
+import sys
+from sqlalchemy import inspect, or_, text
+from sqlalchemy.orm import joinedload
+from database_setup import Item, create_db_engine
+
+SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS item_search USING fts5(
+        name, description,
+        content='item', content_rowid='id',
+        tokenize='porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS item_search_ai AFTER INSERT ON item BEGIN
+        INSERT INTO item_search(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS item_search_ad AFTER DELETE ON item BEGIN
+        INSERT INTO item_search(item_search, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS item_search_au AFTER UPDATE ON item BEGIN
+        INSERT INTO item_search(item_search, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO item_search(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+
+def has_fts(bind):
+    return bind.dialect.name == "sqlite"
+
+
+def setup_search_index(conn):
+    """Create the FTS table and triggers, filling the index if it is new"""
+    if not has_fts(conn):
+        return
+    is_new = not inspect(conn).has_table("item_search")
+    for statement in SEARCH_DDL:
+        conn.execute(text(statement))
+    if is_new:
+        conn.execute(text(
+            "INSERT INTO item_search(item_search) VALUES ('rebuild')"))
+
+
+def drop_search_triggers(conn):
+    """Stop indexing item writes, e.g. for a bulk load; call
+    rebuild_search_index() afterwards to catch up and re-enable them"""
+    for name in ("item_search_ai", "item_search_ad", "item_search_au"):
+        conn.execute(text("DROP TRIGGER IF EXISTS %s" % name))
+
+
+def rebuild_search_index(engine):
+    """Re-create the index from the contents of the item table"""
+    with engine.begin() as conn:
+        setup_search_index(conn)
+        conn.execute(text(
+            "INSERT INTO item_search(item_search) VALUES ('rebuild')"))
+
+
+def build_match(terms):
+    """Turn user input into an FTS5 query matching all words
+
+    Every word is quoted, so operators and stray quotes in the input are
+    searched for literally instead of raising a syntax error.
+    """
+    words = terms.split()
+    return " ".join('"%s"' % w.replace('"', '""') for w in words)
+
+
+def search_item_ids(session, terms, limit, offset=0):
+    """Return the ids of up to ``limit`` items matching ``terms``, best
+    match first"""
+    match = build_match(terms)
+    if not match:
+        return []
+    if not has_fts(session.get_bind()):
+        # No FTS available, fall back to scanning the item table
+        query = session.query(Item.id)
+        for word in terms.split():
+            query = query.filter(or_(Item.name.contains(word),
+                                     Item.description.contains(word)))
+        return [row[0] for row in
+                query.order_by(Item.id).offset(offset).limit(limit)]
+    return [row[0] for row in session.execute(
+        text("SELECT rowid FROM item_search WHERE item_search MATCH :match "
+             "ORDER BY bm25(item_search), rowid LIMIT :limit OFFSET :offset"),
+        {"match": match, "limit": limit, "offset": offset})]
+
+
+def search_items(session, terms, limit, offset=0):
+    """Return up to ``limit`` items matching ``terms``, best match first"""
+    ids = search_item_ids(session, terms, limit, offset)
+    items = session.query(Item).options(joinedload(Item.category)).filter(
+        Item.id.in_(ids)).all() if ids else []
+    by_id = dict((i.id, i) for i in items)
+    return [by_id[i] for i in ids if i in by_id]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python search.py rebuild [database-url]")
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        engine = create_db_engine(sys.argv[2])
+    else:
+        engine = create_db_engine()
+    rebuild_search_index(engine)
+    print("Search index rebuilt")
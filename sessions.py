@@ -0,0 +1,193 @@
+"""Server-side sessions: the cookie only carries a random session id
+
+ServerSessionInterface keeps the session data in a store and only writes
+it back when a request changed it (or when half of its lifetime has
+passed, so active users stay logged in). Visitors whose session stays
+empty never get a cookie or a stored session.
+
+A store needs get(sid) -> (data, expires) or None, set(sid, data,
+expires) and delete(sid), where ``data`` is the serialized session.
+Two are included: MemorySessionStore (per process) and SQLiteSessionStore
+(one database file shared by every worker).
+"""
+import secrets
+import threading
+import time
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import Column, Float, MetaData, String, Table, Text
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.datastructures import CallbackDict
+from lru_cache import LRUCache
+
+metadata = MetaData()
+session_table = Table(
+    "session_store", metadata,
+    Column("id", String(64), primary_key=True),
+    Column("data", Text, nullable=False),
+    Column("expires", Float, nullable=False, index=True),
+)
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session data; like Flask's SecureCookieSession it notes whether it
+    was read (``accessed``), as the response then depends on the cookie"""
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+        self.accessed = False
+        self.replaced_sid = None
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return CallbackDict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        self.accessed = True
+        return CallbackDict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return CallbackDict.get(self, key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return CallbackDict.setdefault(self, key, default)
+
+    def regenerate(self):
+        """Move the session to a new id, e.g. when the logged in user
+        changes, so an id planted before the login is worthless; the old
+        one is deleted when the session is saved"""
+        if self.sid is not None:
+            self.replaced_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class MemorySessionStore(object):
+    """Sessions of this process only, the least recently used ones are
+    dropped beyond ``maxsize``"""
+
+    def __init__(self, maxsize=10000):
+        self._sessions = LRUCache(maxsize)
+
+    def get(self, sid):
+        entry = self._sessions.get(sid)
+        if entry is not None and entry[1] < time.time():
+            self._sessions.pop(sid)
+            return None
+        return entry
+
+    def set(self, sid, data, expires):
+        self._sessions.set(sid, (data, expires))
+
+    def delete(self, sid):
+        self._sessions.pop(sid)
+
+
+class SQLiteSessionStore(object):
+    """Sessions in a SQLite table, shared by every worker using the same
+    database; expired rows are removed every ``cleanup_interval`` writes"""
+
+    def __init__(self, engine, cleanup_interval=1000):
+        self.engine = engine
+        self.cleanup_interval = cleanup_interval
+        self._writes = 0
+        self._lock = threading.Lock()
+        metadata.create_all(engine)
+
+    def get(self, sid):
+        with self.engine.connect() as conn:
+            row = conn.execute(select(
+                session_table.c.data, session_table.c.expires).where(
+                session_table.c.id == sid,
+                session_table.c.expires >= time.time())).first()
+        return tuple(row) if row else None
+
+    def set(self, sid, data, expires):
+        upsert = sqlite_insert(session_table).values(
+            id=sid, data=data, expires=expires)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[session_table.c.id],
+            set_={"data": upsert.excluded.data,
+                  "expires": upsert.excluded.expires})
+        with self.engine.begin() as conn:
+            conn.execute(upsert)
+            if self._should_clean_up():
+                conn.execute(delete(session_table).where(
+                    session_table.c.expires < time.time()))
+
+    def delete(self, sid):
+        with self.engine.begin() as conn:
+            conn.execute(delete(session_table).where(
+                session_table.c.id == sid))
+
+    def _should_clean_up(self):
+        with self._lock:
+            self._writes += 1
+            return self._writes % self.cleanup_interval == 0
+
+
+class ServerSessionInterface(SessionInterface):
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, ttl=31 * 24 * 60 * 60):
+        self.store = store
+        self.ttl = ttl
+
+    def new_sid(self):
+        return secrets.token_urlsafe(32)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            entry = self.store.get(sid)
+            if entry is not None:
+                data, expires = entry
+                return ServerSideSession(self.serializer.loads(data), sid,
+                                         expires)
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        # Pages that read the session differ per user, so shared caches
+        # must not hand them to anyone else
+        if session.accessed:
+            response.vary.add("Cookie")
+        if session.replaced_sid is not None:
+            self.store.delete(session.replaced_sid)
+        if not session:
+            if session.modified and (session.sid or session.replaced_sid):
+                if session.sid:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        now = time.time()
+        if not session.modified and session.expires is not None and \
+                session.expires - now > self.ttl / 2:
+            return
+        is_new = session.sid is None
+        if is_new:
+            session.sid = self.new_sid()
+        session.expires = now + self.ttl
+        self.store.set(session.sid, self.serializer.dumps(dict(session)),
+                       session.expires)
+        if not is_new and not session.permanent:
+            # The browser already has the id
+            return
+        response.set_cookie(name, session.sid,
+                            max_age=self.ttl if session.permanent else None,
+                            domain=domain, path=path,
+                            httponly=self.get_cookie_httponly(app),
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
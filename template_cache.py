@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Template bytecode cache, precompilation and block timings
+
+Jinja compiles a template to Python code the first time it is used, in
+every worker. With a FileSystemBytecodeCache the compiled code is kept on
+disk, where every worker (and every restart) loads it instead of
+compiling again; entries are checked against the template source, so a
+changed template is simply compiled anew. precompile_templates() loads
+all templates up front, so no request pays for the first compile:
+    python template_cache.py compile
+fills the cache at build time, and the app calls it at startup when it
+is not in debug mode (which also turns off the check for changed
+template files on every render). The cached code depends on the
+environment's settings (e.g. autoescaping), so it is always compiled
+through the app's environment.
+
+time_blocks() wraps the blocks of a compiled template so the time spent
+rendering each one is reported, for the template profiler.
+"""
+import os
+import sys
+import time
+from jinja2 import FileSystemBytecodeCache
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def bytecode_cache(directory):
+    """A bytecode cache in ``directory`` (relative to the app)"""
+    directory = os.path.join(ROOT, directory)
+    os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory)
+
+
+def precompile_templates(env):
+    """Load every HTML template of ``env`` and return how many there are"""
+    names = env.list_templates(extensions=("html",))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def time_blocks(template, observe):
+    """Make the blocks of ``template`` call ``observe(template_name,
+    block_name, seconds)`` after rendering, counting only the time spent
+    in the block itself and the blocks nested in it"""
+    for name, render_block in list(template.blocks.items()):
+        template.blocks[name] = timed_block(template.name, name,
+                                            render_block, observe)
+
+
+def timed_block(template_name, block_name, render_block, observe):
+    def block(context):
+        chunks = render_block(context)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield chunk
+        finally:
+            observe(template_name, block_name, elapsed)
+    return block
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != "compile":
+        print("Usage: python template_cache.py compile")
+        sys.exit(1)
+    from app import app
+    if app.jinja_env.bytecode_cache is None:
+        print("The template cache is off, set CATALOG_TEMPLATE_CACHE_DIR "
+              "to the directory to compile the templates into")
+        sys.exit(1)
+    print("Compiled %d templates into %s" % (
+        precompile_templates(app.jinja_env),
+        app.jinja_env.bytecode_cache.directory))
@@ -0,0 +1,66 @@
+"""Fixtures for the tests: the app on a temporary catalog database
+
+The database and session URLs have to be set before ``app`` is imported,
+since it connects (and migrates the database) on import.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_DIR = tempfile.mkdtemp(prefix="catalog-tests-")
+os.environ.update(
+    CATALOG_DATABASE_URL="sqlite:///" + os.path.join(DATA_DIR, "catalog.db"),
+    CATALOG_SESSION_DATABASE_URL="sqlite:///" + os.path.join(
+        DATA_DIR, "sessions.db"),
+    CATALOG_TEMPLATE_CACHE_DIR=os.path.join(DATA_DIR, "template_bytecode"),
+    CATALOG_RATE_LIMIT_STORE="", CATALOG_WRITE_QUEUE="0")
+
+CATEGORIES = 3
+ITEMS_PER_CATEGORY = 20
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def catalog():
+    """The app module, with a user and a few categories of items"""
+    import app
+    from database_setup import Category, Item, User
+    db = app.DBSession()
+    db.add(User(id=1, name="Tester", email="tester@item-catalog",
+                picture=""))
+    for category_id in range(1, CATEGORIES + 1):
+        db.add(Category(id=category_id, name="Category %d" % category_id,
+                        description="Category %d" % category_id))
+        db.add_all(Item(name="Item %d.%d" % (category_id, n),
+                        description="Description", user_id=1,
+                        category_id=category_id)
+                   for n in range(ITEMS_PER_CATEGORY))
+    db.commit()
+    db.close()
+    return app
+
+
+@pytest.fixture
+def client(catalog):
+    return catalog.app.test_client()
+
+
+@pytest.fixture
+def user_client(catalog):
+    """A test client logged in as the seeded user (its pages skip the
+    page cache)"""
+    client = catalog.app.test_client()
+    with client.session_transaction() as session:
+        session.update({"username": "Tester", "user_id": 1,
+                        "token": ["test", ""], "provider": "test",
+                        "email": "tester@item-catalog", "picture": "",
+                        "link": ""})
+    return client
@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+
+
+class QueryCounter(object):
+    """Count the SQL statements one or more engines execute while active"""
+
+    def __init__(self, *engines):
+        self.engines = engines
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        for engine in set(self.engines):
+            event.listen(engine, "before_cursor_execute",
+                         self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in set(self.engines):
+            event.remove(engine, "before_cursor_execute",
+                         self._before_cursor_execute)
+        return False
+
+
+@contextmanager
+def assert_max_queries(engine, maximum, *engines):
+    """Fail if the wrapped block runs more than ``maximum`` statements on
+    ``engine`` (and any further ``engines``)
+
+    Usage:
+        with assert_max_queries(app.engine, 2, app.read_engine):
+            client.get("/feed")
+    """
+    with QueryCounter(engine, *engines) as counter:
+        yield counter
+    if counter.count > maximum:
+        raise AssertionError(
+            "Expected at most %d SQL statements, got %d:\n%s" % (
+                maximum, counter.count, "\n".join(counter.statements)))
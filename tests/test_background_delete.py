@@ -0,0 +1,82 @@
+"""Deleting a large category in the background under gevent workers"""
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in its own process, as gevent has to patch the standard library
+# before anything else is imported (as gunicorn's gevent worker does)
+WORKER = """
+from gevent import monkey
+monkey.patch_all()
+import json
+import time
+import gevent
+import app
+from database_setup import Category, Item, User
+
+db = app.DBSession()
+db.add(User(id=1, name="Tester", email="tester@item-catalog", picture=""))
+db.add(Category(id=1, name="Large", description="Large"))
+db.commit()
+db.execute(Item.__table__.insert(), [
+    {"name": "Item %d" % n, "user_id": 1, "category_id": 1}
+    for n in range(ITEMS)])
+db.commit()
+db.close()
+client = app.app.test_client()
+with client.session_transaction() as session:
+    session.update({"username": "Tester", "user_id": 1,
+                    "token": ["test", ""]})
+
+gaps = []
+running = [True]
+
+
+def tick():
+    last = time.perf_counter()
+    while running[0]:
+        gevent.sleep(0.001)
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+
+
+ticker = gevent.spawn(tick)
+start = time.perf_counter()
+assert client.get("/category/1/delete").status_code == 302
+request = time.perf_counter() - start
+while True:
+    db = app.DBSession()
+    left = db.query(Category).filter_by(id=1).count()
+    db.close()
+    if not left:
+        break
+    gevent.sleep(0.01)
+total = time.perf_counter() - start
+running[0] = False
+ticker.join()
+print(json.dumps({"request": request, "total": total,
+                  "max_gap": max(gaps)}))
+"""
+
+
+def test_delete_yields_to_other_greenlets(tmp_path):
+    pytest.importorskip("gevent")
+    env = dict(os.environ,
+               CATALOG_DATABASE_URL="sqlite:///" + str(tmp_path / "c.db"),
+               CATALOG_SESSION_BACKEND="memory",
+               CATALOG_BACKGROUND_DELETE_THRESHOLD="1000",
+               CATALOG_DELETE_BATCH_SIZE="200")
+    result = subprocess.run(
+        [sys.executable, "-c", WORKER.replace("ITEMS", "20000")],
+        cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    timings = json.loads(result.stdout.splitlines()[-1])
+    # The request returns and the rest of the worker keeps running while
+    # the batches are deleted
+    assert timings["request"] < timings["total"] / 4
+    assert timings["max_gap"] < timings["total"] / 4
@@ -0,0 +1,21 @@
+"""POST /api/items"""
+
+
+def test_bulk_create(user_client):
+    response = user_client.post("/api/items.json", json=[
+        {"name": "Bulk", "description": "Created in bulk", "category_id": 3},
+        {"name": "Bulk", "description": "Nowhere", "category_id": 999}])
+    assert response.status_code == 200
+    assert [r["status"] for r in response.get_json()["Results"]] == [
+        "created", "error"]
+
+
+def test_bulk_items_of_deleted_user(catalog):
+    client = catalog.app.test_client()
+    with client.session_transaction() as session:
+        session.update({"username": "Gone", "user_id": 999,
+                        "token": ["test", ""]})
+    response = client.post("/api/items.json", json=[
+        {"name": "Orphan", "description": "No author", "category_id": 1}])
+    assert response.status_code == 401
+    assert "Error" in response.get_json()
@@ -0,0 +1,58 @@
+"""Requests served in parallel each use their own DB session"""
+import threading
+from database_setup import Item
+
+THREADS = 8
+REQUESTS = 10
+
+
+def test_show_category_and_new_item_in_parallel(catalog):
+    db = catalog.DBSession()
+    before = db.query(Item).filter_by(category_id=2).count()
+    db.close()
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def reader(number):
+        client = catalog.app.test_client()
+        start.wait()
+        for _ in range(REQUESTS):
+            response = client.get("/category/2")
+            if response.status_code != 200 or b"Item 2." not in \
+                    response.data:
+                errors.append(("GET", response.status_code))
+
+    def writer(number):
+        client = catalog.app.test_client()
+        with client.session_transaction() as session:
+            session.update({"username": "Tester", "user_id": 1,
+                            "token": ["test", ""]})
+        start.wait()
+        for n in range(REQUESTS):
+            response = client.post("/category/2/new", data={
+                "name": "Parallel %d.%d" % (number, n),
+                "description": "Created in parallel"})
+            if response.status_code != 302 or not response.headers[
+                    "Location"].startswith("/category/2/"):
+                errors.append(("POST", response.status_code))
+
+    threads = [threading.Thread(target=reader if n % 2 else writer,
+                                args=(n,))
+               for n in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    db = catalog.DBSession()
+    names = set(name for name, in db.query(Item.name).filter(
+        Item.name.like("Parallel %")))
+    after = db.query(Item).filter_by(category_id=2).count()
+    db.close()
+    assert names == set("Parallel %d.%d" % (number, n)
+                        for number in range(0, THREADS, 2)
+                        for n in range(REQUESTS))
+    assert after == before + len(names)
+    # Every request closed its session, so a later one starts afresh
+    assert catalog.app.test_client().get("/category/2").status_code == 200
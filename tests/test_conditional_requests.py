@@ -0,0 +1,30 @@
+"""Revalidating cached copies of the feed and the category list"""
+import datetime
+from werkzeug.http import http_date
+from database_setup import Category
+
+
+def test_deleted_category_is_not_served_as_unmodified(catalog, client,
+                                                      user_client):
+    db = catalog.DBSession()
+    older = Category(name="Deleted soon", description="Older")
+    db.add(older)
+    db.commit()
+    db.add(Category(name="Kept", description="Newer"))
+    db.commit()
+    older_id = older.id
+    db.close()
+    for url in ("/api/categories.json", "/feed"):
+        response = client.get(url)
+        assert response.status_code == 200
+        assert b"Deleted soon" in response.data
+        assert response.last_modified is None
+
+    response = user_client.get("/category/%d/delete" % older_id)
+    assert response.status_code == 302
+
+    since = http_date(datetime.datetime.now(datetime.timezone.utc))
+    for url in ("/api/categories.json", "/feed"):
+        response = client.get(url, headers={"If-Modified-Since": since})
+        assert response.status_code == 200, url
+        assert b"Deleted soon" not in response.data
@@ -0,0 +1,81 @@
+"""The hot lookups use their indexes and migrations add them to old
+databases"""
+from sqlalchemy import inspect, text
+from database_setup import Item, User, create_db_engine
+from migrations import upgrade
+
+# The schema of databases created before the indexes existed
+BASELINE_SCHEMA = [
+    """CREATE TABLE user (
+        id INTEGER NOT NULL, name VARCHAR(250) NOT NULL,
+        email VARCHAR(250) NOT NULL, picture VARCHAR(250),
+        PRIMARY KEY (id))""",
+    """CREATE TABLE category (
+        id INTEGER NOT NULL, name VARCHAR(250) NOT NULL,
+        description VARCHAR(250) NOT NULL, PRIMARY KEY (id))""",
+    """CREATE TABLE item (
+        id INTEGER NOT NULL, name VARCHAR(250) NOT NULL, user_id INTEGER,
+        category_id INTEGER, created DATETIME, description VARCHAR,
+        PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id),
+        FOREIGN KEY(category_id) REFERENCES category (id))""",
+]
+
+
+def query_plan(engine, query):
+    sql = str(query.statement.compile(engine,
+                                      compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        return " ".join(row[3] for row in conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + sql))
+
+
+def test_category_listing_uses_index(catalog):
+    query = catalog.session.query(Item).filter(
+        Item.category_id == 1, Item.id > 0).order_by(Item.id).limit(21)
+    plan = query_plan(catalog.read_engine, query)
+    catalog.session.remove()
+    assert "USING INDEX ix_item_category_id_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_email_lookup_uses_index(catalog):
+    query = catalog.session.query(User).filter_by(
+        email="tester@item-catalog")
+    plan = query_plan(catalog.read_engine, query)
+    catalog.session.remove()
+    assert "USING INDEX ix_user_email" in plan
+
+
+def test_upgrade_adds_indexes_to_baseline_database(tmp_path):
+    engine = create_db_engine("sqlite:///" + str(tmp_path / "old.db"))
+    with engine.begin() as conn:
+        for ddl in BASELINE_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text(
+            "INSERT INTO user (id, name, email) VALUES "
+            "(1, 'First', 'same@item-catalog'), "
+            "(2, 'Second', 'same@item-catalog')"))
+        conn.execute(text(
+            "INSERT INTO category (id, name, description) "
+            "VALUES (1, 'Category', '')"))
+        conn.execute(text(
+            "INSERT INTO item (id, name, user_id, category_id) "
+            "VALUES (1, 'Item', 2, 1)"))
+    assert inspect(engine).get_indexes("item") == []
+
+    upgrade(engine)
+
+    with engine.connect() as conn:
+        indexes = dict(conn.execute(text(
+            "SELECT name, tbl_name FROM sqlite_master "
+            "WHERE type = 'index' AND name LIKE 'ix_%'")).fetchall())
+        users = conn.execute(text("SELECT id FROM user")).fetchall()
+        author = conn.execute(text("SELECT user_id FROM item")).scalar()
+    engine.dispose()
+    assert indexes == {"ix_user_email": "user",
+                       "ix_item_category_id_id": "item",
+                       "ix_item_user_id": "item"}
+    # Duplicate accounts are merged into the oldest before the unique
+    # index is created
+    assert users == [(1,)]
+    assert author == 1
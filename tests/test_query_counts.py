@@ -0,0 +1,23 @@
+"""The pages and API routes run a fixed number of SQL statements, no
+matter how many items they list (no N+1 lazy loads)"""
+import pytest
+from query_counter import assert_max_queries
+
+ROUTES = [
+    ("/feed", 2),
+    ("/category/1/1", 1),
+    ("/api/categories.json", 2),
+    ("/api/category/1.json", 3),
+    ("/api/item/1.json", 2),
+    ("/api/items.json?ids=1,2,3,21,22,41", 1),
+    ("/api/search.json?q=Item", 2),
+]
+
+
+@pytest.mark.parametrize("url,maximum", ROUTES)
+def test_max_queries(catalog, user_client, url, maximum):
+    # Logged in, so the pages are rendered instead of coming from the
+    # page cache
+    with assert_max_queries(catalog.engine, maximum, catalog.read_engine):
+        response = user_client.get(url)
+    assert response.status_code == 200
@@ -0,0 +1,7 @@
+"""Server-side sessions"""
+
+
+def test_logged_in_page_varies_by_cookie(user_client):
+    for url in ("/feed", "/users/list", "/search?q=Item", "/login"):
+        response = user_client.get(url)
+        assert "Cookie" in response.vary, url
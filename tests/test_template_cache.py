@@ -0,0 +1,28 @@
+"""python template_cache.py compile"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def compile_templates(tmp_path, cache_dir):
+    env = dict(os.environ,
+               CATALOG_DATABASE_URL="sqlite:///" + str(tmp_path / "c.db"),
+               CATALOG_TEMPLATE_CACHE_DIR=cache_dir)
+    return subprocess.run([sys.executable, "template_cache.py", "compile"],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+def test_compile(tmp_path):
+    result = compile_templates(tmp_path, str(tmp_path / "bytecode"))
+    assert result.returncode == 0
+    assert result.stdout.startswith("Compiled")
+    assert os.listdir(str(tmp_path / "bytecode"))
+
+
+def test_compile_without_cache_dir(tmp_path):
+    result = compile_templates(tmp_path, "")
+    assert result.returncode == 1
+    assert "The template cache is off" in result.stdout
+    assert "Traceback" not in result.stderr
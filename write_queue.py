@@ -0,0 +1,119 @@
+"""Group commit: one thread commits the writes of many requests together
+
+With SQLite every commit takes the write lock and (depending on
+``synchronous``) syncs the journal to disk, so committing each form
+submit on its own caps writes at that rate. WriteQueue runs the queued
+jobs on a single writer thread instead: it takes the first job waiting,
+collects whatever else arrives within ``max_delay`` seconds (up to
+``max_batch`` jobs) and runs them all in one transaction. If a job
+fails, the batch is rolled back and its jobs run again one transaction
+each, so the failing job does not take the others down with it.
+
+A job is a function taking the writer's ORM session. Whatever it returns
+(e.g. the id of a new row, after ``session.flush()``) is handed back by
+``run()`` once the batch has been committed, so callers can redirect to
+a row that is already visible to everyone. As a job may run twice, it
+should create its objects itself, and as they are expired by the commit
+it should return plain values rather than ORM objects.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+STOP = object()
+
+
+class WriteQueue(object):
+
+    def __init__(self, session_factory, max_batch=64, max_delay=0.005):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.jobs = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        """Queue ``job(session)`` and return a Future of its result"""
+        future = Future()
+        self._start()
+        self._queue.put((job, future))
+        return future
+
+    def run(self, job, timeout=None):
+        """Queue ``job(session)`` and wait until it has been committed;
+        returns what the job returned or raises what it (or the commit)
+        raised"""
+        return self.submit(job).result(timeout)
+
+    def close(self):
+        """Commit the jobs queued so far and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(STOP)
+            thread.join()
+
+    def _start(self):
+        # Started on first use, so forked workers each get their own
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work,
+                                                name="write-queue")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            first = self._queue.get()
+            if first is STOP:
+                return
+            batch = [first]
+            stopping = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        entry = self._queue.get(timeout=remaining)
+                    else:
+                        entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            batch = [(job, future) for job, future in batch
+                     if future.set_running_or_notify_cancel()]
+            if not self._commit(batch) and len(batch) > 1:
+                for entry in batch:
+                    self._commit([entry])
+            if stopping:
+                return
+
+    def _commit(self, batch):
+        """Run ``batch`` in one transaction and resolve its futures; if it
+        fails with several jobs, leave them pending and return False"""
+        session = self.session_factory()
+        results = []
+        try:
+            for job, future in batch:
+                results.append(job(session))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if len(batch) > 1:
+                return False
+            batch[0][1].set_exception(e)
+        else:
+            self.batches += 1
+            self.jobs += len(batch)
+            for (job, future), result in zip(batch, results):
+                future.set_result(result)
+        finally:
+            session.close()
+        return True